@@ -1,7 +1,25 @@
 import json
+import os
+from datetime import datetime
 from typing import Any, Optional
 
-from db import get_db
+from batch_writer import BatchWriter
+
+
+# Auditoria é append-only: o request só enfileira; a thread grava em lote (executemany).
+# Fila limitada com back-pressure: cheia, o request espera (e no limite grava direto),
+# nunca descarta registro de auditoria; falha do banco na gravação é repetida com backoff.
+_audit_writer = BatchWriter(
+    "audit",
+    """
+    INSERT INTO audit_logs (tenant_id, actor_user_id, action, entity, entity_id, meta_json, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    """,
+    maxsize=int(os.getenv("AUDIT_QUEUE_MAX", "10000")),
+    block_timeout=float(os.getenv("AUDIT_QUEUE_BLOCK_SECONDS", "1.0")),
+    retries=int(os.getenv("AUDIT_WRITE_RETRIES", "5")),
+    retry_backoff=float(os.getenv("AUDIT_WRITE_RETRY_BACKOFF", "0.05")),
+)
 
 
 def write_audit(
@@ -12,19 +30,27 @@ def write_audit(
     entity_id: Optional[str],
     meta: dict[str, Any],
 ) -> None:
-    with get_db() as db:
-        db.execute(
-            """
-            INSERT INTO audit_logs (tenant_id, actor_user_id, action, entity, entity_id, meta_json, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                tenant_id,
-                actor_user_id,
-                action,
-                entity,
-                entity_id,
-                json.dumps(meta, ensure_ascii=False),
-                __import__("datetime").datetime.utcnow().isoformat() + "Z",
-            ),
+    # meta serializado aqui (snapshot no momento da ação); created_at também.
+    _audit_writer.put(
+        (
+            tenant_id,
+            actor_user_id,
+            action,
+            entity,
+            entity_id,
+            json.dumps(meta, ensure_ascii=False),
+            datetime.utcnow().isoformat() + "Z",
         )
+    )
+
+
+def start_audit_writer() -> None:
+    _audit_writer.start()
+
+
+def stop_audit_writer() -> None:
+    _audit_writer.stop()
+
+
+def flush_audit() -> int:
+    return _audit_writer.flush()
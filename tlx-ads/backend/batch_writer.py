@@ -0,0 +1,167 @@
+"""Gravação em lote fora do caminho do request.
+
+Handlers só fazem `put()` (memória); uma thread de fundo drena a fila e grava
+com um único `executemany` por transação. Usado para tabelas append-only
+(auditoria, métricas), onde perder a ordem exata entre requests não importa.
+
+Com `maxsize > 0` a fila é limitada: cheia, descarta o item mais antigo
+(back-pressure sem bloquear o request). Para dados que não podem ser perdidos
+(auditoria), `block_timeout` faz o produtor esperar por vaga e, se a fila
+continuar cheia, grava o item direto na thread do request; e `retries` repete a
+gravação (com backoff exponencial) quando o banco falha, ex.: "database is locked".
+"""
+
+from __future__ import annotations
+
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from db import get_db
+
+
+logger = logging.getLogger(__name__)
+
+
+class BatchWriter:
+    def __init__(
+        self,
+        name: str,
+        insert_sql: str,
+        batch_max: int = 500,
+        flush_interval: float = 0.05,
+        maxsize: int = 0,
+        block_timeout: Optional[float] = None,
+        retries: int = 0,
+        retry_backoff: float = 0.05,
+    ):
+        self.name = name
+        self.insert_sql = insert_sql
+        self.batch_max = int(batch_max)
+        self.flush_interval = float(flush_interval)
+        self.block_timeout = block_timeout
+        self.retries = int(retries)
+        self.retry_backoff = float(retry_backoff)
+        self.dropped = 0
+        self._queue: "queue.Queue[tuple]" = queue.Queue(maxsize=int(maxsize))
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def put(self, row: tuple) -> None:
+        if self.block_timeout is not None:
+            try:
+                self._queue.put(row, timeout=self.block_timeout)
+            except queue.Full:
+                # writer atrasado (ou parado): grava síncrono em vez de perder o item
+                self._insert([row])
+            return
+
+        while True:
+            try:
+                self._queue.put_nowait(row)
+                return
+            except queue.Full:
+                # drop-oldest: o evento novo vale mais que o mais antigo ainda não gravado
+                try:
+                    self._queue.get_nowait()
+                    self._queue.task_done()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"batch-writer-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+    def flush(self) -> int:
+        # Drena tudo o que estiver na fila e espera o lote em voo da thread (shutdown e testes).
+        total = 0
+        while True:
+            batch = self._drain(self.batch_max)
+            if not batch:
+                break
+            self._write(batch)
+            total += len(batch)
+        self._queue.join()
+        return total
+
+    def _drain(self, limit: int) -> list[tuple]:
+        batch: list[tuple] = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            # Junta até batch_max itens ou flush_interval, o que vier primeiro.
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_max:
+                wait = deadline - time.monotonic()
+                if wait <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=wait))
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, batch: list[tuple]) -> None:
+        try:
+            self._insert(batch)
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    def _insert(self, batch: list[tuple]) -> None:
+        with self._write_lock:
+            delay = self.retry_backoff
+            for attempt in range(self.retries + 1):
+                try:
+                    try:
+                        with get_db() as db:
+                            db.executemany(self.insert_sql, batch)
+                    except sqlite3.IntegrityError:
+                        # uma linha inválida (ex.: FK de tenant/ad inexistente) não derruba o lote inteiro
+                        self._write_rows(batch)
+                    return
+                except Exception:
+                    # falha do banco (lock, I/O): a transação foi desfeita, então repetir não duplica
+                    if attempt >= self.retries:
+                        logger.exception("batch writer %s: falha ao gravar %d linhas", self.name, len(batch))
+                        return
+                    logger.warning(
+                        "batch writer %s: tentativa %d falhou, repetindo em %.2fs", self.name, attempt + 1, delay
+                    )
+                    time.sleep(delay)
+                    delay *= 2
+
+    def _write_rows(self, batch: list[tuple]) -> None:
+        with get_db() as db:
+            for row in batch:
+                try:
+                    db.execute(self.insert_sql, row)
+                except sqlite3.IntegrityError:
+                    logger.warning("batch writer %s: linha descartada (integridade)", self.name)
@@ -1,12 +1,46 @@
 import os
+import queue
 import sqlite3
-from contextlib import contextmanager
+from contextlib import asynccontextmanager, contextmanager
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Iterator
+from typing import AsyncIterator, Iterator, Optional
+
+import aiosqlite
+from aiosqlitepool import SQLiteConnectionPool
 
 
 DB_PATH = Path(os.getenv("TLX_ADS_DB_PATH", str(Path(__file__).resolve().parent / "data.sqlite3")))
+POOL_SIZE = int(os.getenv("TLX_ADS_POOL_SIZE", str(min((os.cpu_count() or 1) * 2, 10))))
+ASYNC_POOL_SIZE = int(os.getenv("TLX_ADS_ASYNC_POOL_SIZE", "5"))
+# Cache de statements preparados por conexão (sqlite3 usa o texto do SQL como chave).
+# O padrão (128) é menor que o número de SQLs distintos da API; acima disso há re-prepare.
+STATEMENT_CACHE_SIZE = int(os.getenv("TLX_ADS_STATEMENT_CACHE_SIZE", "512"))
+# synchronous=OFF só para bancos descartáveis (smoke test com TLX_ADS_TEST_FAST=1): perde
+# durabilidade em queda de energia. mmap_size=0 mantém o padrão do SQLite.
+SQLITE_SYNCHRONOUS = os.getenv("TLX_ADS_SQLITE_SYNCHRONOUS", "NORMAL").upper()
+if SQLITE_SYNCHRONOUS not in ("OFF", "NORMAL", "FULL", "EXTRA"):
+    SQLITE_SYNCHRONOUS = "NORMAL"  # valor vai direto no PRAGMA: só aceita os nomes conhecidos
+SQLITE_MMAP_SIZE = int(os.getenv("TLX_ADS_SQLITE_MMAP_SIZE", "0"))
+# URI do SQLite (ex.: "file::memory:?cache=shared" no smoke test): sem diretório a criar.
+DB_IS_URI = str(DB_PATH).startswith("file:")
+
+# Pragmas por conexão, iguais para o pool síncrono e o async (leituras e escritas com o mesmo
+# cache/mmap). Os de WAL vão à parte: alguns ambientes não suportam e seguem no padrão.
+_BASE_PRAGMAS: tuple[str, ...] = (
+    "PRAGMA foreign_keys = ON;",
+    "PRAGMA busy_timeout = 5000;",
+    "PRAGMA temp_store = MEMORY;",
+    "PRAGMA cache_size = -64000;",
+) + ((f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE};",) if SQLITE_MMAP_SIZE > 0 else ())
+_WAL_PRAGMAS: tuple[str, ...] = (
+    "PRAGMA journal_mode = WAL;",
+    f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS};",
+)
+
+_POOL: "queue.Queue[sqlite3.Connection]" = queue.Queue(maxsize=POOL_SIZE)
+
+_async_pool: Optional[SQLiteConnectionPool] = None
 
 
 def now_iso() -> str:
@@ -15,18 +49,21 @@ def now_iso() -> str:
 
 def _connect() -> sqlite3.Connection:
     # check_same_thread=False para permitir uso em apps web (FastAPI/uvicorn) com múltiplas threads.
-    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=30)
+    if not DB_IS_URI:
+        DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(
+        str(DB_PATH), check_same_thread=False, timeout=30, cached_statements=STATEMENT_CACHE_SIZE, uri=DB_IS_URI
+    )
     conn.row_factory = sqlite3.Row
 
     # Pragmas básicos
-    conn.execute("PRAGMA foreign_keys = ON;")
-    conn.execute("PRAGMA busy_timeout = 5000;")
+    for pragma in _BASE_PRAGMAS:
+        conn.execute(pragma)
 
     # Melhorias de concorrência/performance em SQLite (seguras para dev/prod pequeno)
     try:
-        conn.execute("PRAGMA journal_mode = WAL;")
-        conn.execute("PRAGMA synchronous = NORMAL;")
+        for pragma in _WAL_PRAGMAS:
+            conn.execute(pragma)
     except Exception:
         # Alguns ambientes podem não suportar WAL (ex.: FS restrito). Segue no padrão.
         pass
@@ -34,9 +71,25 @@ def _connect() -> sqlite3.Connection:
     return conn
 
 
+def _acquire() -> sqlite3.Connection:
+    try:
+        return _POOL.get_nowait()
+    except queue.Empty:
+        # pool vazio (ou todas em uso): abre uma nova; na devolução ela entra no pool se houver vaga
+        return _connect()
+
+
+def _release(conn: sqlite3.Connection) -> None:
+    try:
+        _POOL.put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
+
 @contextmanager
 def get_db() -> Iterator[sqlite3.Connection]:
-    conn = _connect()
+    # Conexões longas reaproveitadas (pragmas/schema/cache já carregados); commit/rollback por uso.
+    conn = _acquire()
     try:
         yield conn
         conn.commit()
@@ -44,7 +97,61 @@ def get_db() -> Iterator[sqlite3.Connection]:
         conn.rollback()
         raise
     finally:
-        conn.close()
+        # só volta ao pool conexão limpa (sem transação pendente)
+        if conn.in_transaction:
+            conn.close()
+        else:
+            _release(conn)
+
+
+def close_pool() -> None:
+    while True:
+        try:
+            _POOL.get_nowait().close()
+        except queue.Empty:
+            return
+
+
+async def _async_connect() -> aiosqlite.Connection:
+    # Conexão do pool async: pragmas rodam uma vez por conexão (não por request).
+    if not DB_IS_URI:
+        DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+    conn = await aiosqlite.connect(
+        str(DB_PATH), timeout=30, cached_statements=STATEMENT_CACHE_SIZE, uri=DB_IS_URI
+    )
+    conn.row_factory = sqlite3.Row
+
+    for pragma in _BASE_PRAGMAS:
+        await conn.execute(pragma)
+    try:
+        for pragma in _WAL_PRAGMAS:
+            await conn.execute(pragma)
+    except Exception:
+        pass
+
+    return conn
+
+
+def _get_async_pool() -> SQLiteConnectionPool:
+    global _async_pool
+    if _async_pool is None:
+        _async_pool = SQLiteConnectionPool(_async_connect, pool_size=ASYNC_POOL_SIZE)
+    return _async_pool
+
+
+@asynccontextmanager
+async def get_async_db() -> AsyncIterator[aiosqlite.Connection]:
+    # Somente leitura (list/get): conexões ficam quentes no pool e o handler roda no event loop.
+    # Escritas continuam em get_db() (transação síncrona simples).
+    async with _get_async_pool().connection() as conn:
+        yield conn
+
+
+async def close_async_pool() -> None:
+    global _async_pool
+    if _async_pool is not None:
+        pool, _async_pool = _async_pool, None
+        await pool.close()
 
 
 def init_db() -> None:
@@ -413,8 +520,14 @@ def init_db() -> None:
         db.execute("CREATE INDEX IF NOT EXISTS idx_templates_tenant ON templates(tenant_id, id);")
         db.execute("CREATE INDEX IF NOT EXISTS idx_links_tenant_slug ON short_links(tenant_id, slug);")
         db.execute("CREATE INDEX IF NOT EXISTS idx_memberships_tenant ON memberships(tenant_id);")
-        db.execute("CREATE INDEX IF NOT EXISTS idx_metric_tenant_type ON metric_events(tenant_id, event_type);")
-        db.execute("CREATE INDEX IF NOT EXISTS idx_metric_tenant_day ON metric_events(tenant_id, created_at);")
+        # Cobrem os dashboards (SUM(value) sem tocar na tabela); substituem os índices só-prefixo.
+        db.execute("DROP INDEX IF EXISTS idx_metric_tenant_type;")
+        db.execute("DROP INDEX IF EXISTS idx_metric_tenant_day;")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_metric_tenant_type_value ON metric_events(tenant_id, event_type, value);")
+        db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_metric_tenant_created_cov "
+            "ON metric_events(tenant_id, created_at, event_type, value, ad_id);"
+        )
         db.execute("CREATE INDEX IF NOT EXISTS idx_audit_tenant ON audit_logs(tenant_id);")
 
         db.execute("CREATE INDEX IF NOT EXISTS idx_tplan_tenant ON tenant_plans(tenant_id);")
@@ -431,9 +544,42 @@ def init_db() -> None:
         db.execute("CREATE INDEX IF NOT EXISTS idx_segments_name ON segments(tenant_id, name);")
         db.execute("CREATE INDEX IF NOT EXISTS idx_segment_members ON segment_members(segment_id, contact_id);")
         db.execute("CREATE INDEX IF NOT EXISTS idx_deliveries_queue ON deliveries(tenant_id, status, next_attempt_at, id);")
-        db.execute("CREATE INDEX IF NOT EXISTS idx_deliveries_tenant_created ON deliveries(tenant_id, created_at);")
+        # SLA / campanhas: range por created_at coberto (status, attempts, updated_at, campaign_id).
+        db.execute("DROP INDEX IF EXISTS idx_deliveries_tenant_created;")
+        db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_deliveries_tenant_created_cov "
+            "ON deliveries(tenant_id, created_at, status, attempts, updated_at, campaign_id);"
+        )
+        # run-due: índice parcial só com os anúncios agendados, já em ordem de id.
+        db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_ads_scheduled "
+            "ON ads(id, tenant_id, channel, scheduled_at) WHERE status = 'scheduled';"
+        )
 
         db.execute("CREATE INDEX IF NOT EXISTS idx_invite_tenant_email ON invite_tokens(tenant_id, email);")
         db.execute("CREATE INDEX IF NOT EXISTS idx_invite_token ON invite_tokens(token);")
         db.execute("CREATE INDEX IF NOT EXISTS idx_reset_token ON password_reset_tokens(token);")
         db.execute("CREATE INDEX IF NOT EXISTS idx_reset_user ON password_reset_tokens(user_id);")
+
+        # Uso mensal contabilizado pelo próprio SQLite (mesma transação do INSERT do recurso).
+        # O check de quota continua no Python, antes do INSERT. Mês/horário em UTC, como em saas.py.
+        for table, field in (
+            ("ads", "ads_created"),
+            ("templates", "templates_created"),
+            ("short_links", "links_created"),
+            ("invite_tokens", "invites_created"),
+        ):
+            db.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS trg_usage_{table} AFTER INSERT ON {table}
+                BEGIN
+                  INSERT INTO tenant_usage_monthly (tenant_id, month, {field}, created_at, updated_at)
+                  VALUES (
+                    NEW.tenant_id, strftime('%Y-%m', 'now'), 1,
+                    strftime('%Y-%m-%dT%H:%M:%S+00:00', 'now'), strftime('%Y-%m-%dT%H:%M:%S+00:00', 'now')
+                  )
+                  ON CONFLICT(tenant_id, month) DO UPDATE
+                  SET {field} = {field} + 1, updated_at = excluded.updated_at;
+                END;
+                """
+            )
@@ -14,64 +14,87 @@ Cron (a cada minuto):
 
 from __future__ import annotations
 
-from datetime import datetime, timezone
+from typing import Optional
+
+from fastapi import HTTPException
 
 from db import get_db, init_db, now_iso
-from saas import check_daily_send_or_raise, increment_daily_send
+from saas import check_daily_send_or_raise, daily_send_remaining, increment_daily_send
 
 
-def main() -> None:
-    init_db()
-    now = datetime.now(timezone.utc)
+def run_due_once(details: str = "Cron delivery", ts: Optional[str] = None) -> int:
+    """Dispara os anúncios scheduled vencidos (usado também por POST /jobs/run-due).
+
+    Vencidos são filtrados no SQL (julianday; datas inválidas ficam de fora). A quota diária é
+    lida uma vez por tenant e consumida em memória; no fim: UPDATE/INSERT via executemany e um
+    incremento de uso por (tenant, canal). Sem quota: registra 'fail' e mantém scheduled.
+    `ts` (opcional) é o instante único da execução, reaproveitado por quem chama.
+    """
+    ts = ts or now_iso()
 
     with get_db() as db:
         rows = db.execute(
             """
-            SELECT id, tenant_id, channel, scheduled_at
+            SELECT id, tenant_id, channel
             FROM ads
             WHERE status = 'scheduled' AND scheduled_at IS NOT NULL
-            """
+              AND julianday(scheduled_at) <= julianday(?)
+            ORDER BY id
+            """,
+            (ts,),
         ).fetchall()
 
-        sent = 0
-        for r in rows:
-            ad_id = int(r["id"])
-            tenant_id = int(r["tenant_id"])
-            channel = str(r["channel"] or "")
-            try:
-                sched = datetime.fromisoformat(str(r["scheduled_at"]).replace("Z", "+00:00"))
-            except Exception:
+        remaining: dict[int, Optional[int]] = {}
+        used: dict[int, int] = {}
+        quota_detail: dict[int, str] = {}
+        sends: dict[tuple[int, str], int] = {}
+        sent_rows: list[tuple] = []
+        delivery_rows: list[tuple] = []
+
+        for ad_id, tenant_id, channel in rows:
+            if tenant_id not in remaining:
+                remaining[tenant_id] = daily_send_remaining(db, tenant_id)
+            left = remaining[tenant_id]
+            n = used.get(tenant_id, 0)
+
+            if left is not None and n >= left:
+                # mensagem da quota montada uma vez por tenant (mesmo plano/dia no run inteiro)
+                detail = quota_detail.get(tenant_id)
+                if detail is None:
+                    detail = "Limite diário de envios atingido."
+                    try:
+                        check_daily_send_or_raise(db, tenant_id, n + 1)
+                    except HTTPException as e:
+                        detail = e.detail
+                    quota_detail[tenant_id] = detail
+                delivery_rows.append((ad_id, ts, "fail", f"Quota exceeded: {detail}"))
                 continue
 
-            if sched <= now:
-                try:
-                    check_daily_send_or_raise(db, tenant_id, 1)
-                except Exception as e:
-                    # registra falha e mantém status scheduled
-                    db.execute(
-                        """
-                        INSERT INTO ad_deliveries (ad_id, delivered_at, result, details)
-                        VALUES (?, ?, 'fail', ?)
-                        """,
-                        (ad_id, now_iso(), f"Quota exceeded: {getattr(e, 'detail', str(e))}"),
-                    )
-                    continue
-
-                db.execute(
-                    "UPDATE ads SET status = 'sent', updated_at = ? WHERE id = ?",
-                    (now_iso(), ad_id),
-                )
-                db.execute(
-                    """
-                    INSERT INTO ad_deliveries (ad_id, delivered_at, result, details)
-                    VALUES (?, ?, 'ok', ?)
-                    """,
-                    (ad_id, now_iso(), "Cron delivery"),
-                )
-                increment_daily_send(db, tenant_id, channel, 1)
-                sent += 1
-
-    print({"sent": sent, "ts": now_iso()})
+            used[tenant_id] = n + 1
+            key = (tenant_id, str(channel or ""))
+            sends[key] = sends.get(key, 0) + 1
+            sent_rows.append((ts, ad_id))
+            delivery_rows.append((ad_id, ts, "ok", details))
+
+        db.executemany("UPDATE ads SET status = 'sent', updated_at = ? WHERE id = ?", sent_rows)
+        db.executemany(
+            """
+            INSERT INTO ad_deliveries (ad_id, delivered_at, result, details)
+            VALUES (?, ?, ?, ?)
+            """,
+            delivery_rows,
+        )
+        for (tenant_id, channel), amount in sends.items():
+            increment_daily_send(db, tenant_id, channel, amount)
+
+    return len(sent_rows)
+
+
+def main() -> None:
+    init_db()
+    ts = now_iso()
+    sent = run_due_once(ts=ts)
+    print({"sent": sent, "ts": ts})
 
 
 if __name__ == "__main__":
@@ -16,7 +16,7 @@ from datetime import datetime, timedelta, timezone
 from db import get_db, init_db, now_iso
 
 
-def _should_fail(channel: str, to_addr: str, payload_json: str) -> bool:
+def _should_fail(channel: str, to_addr: str, payload_json: str | bytes) -> bool:
     # Falha determinística para facilitar testes:
     # - to_addr contém "fail" ou
     # - payload_json tem {"force_fail": true}
@@ -68,7 +68,8 @@ def process_once(batch: int = 50) -> dict:
             max_attempts = int(r["max_attempts"] or 5)
             channel = str(r["channel"] or "")
             to_addr = str(r["to_addr"] or "")
-            payload_json = str(r["payload_json"] or "{}")
+            # payload_json pode vir como bytes (orjson/BLOB) ou str (linhas antigas); json.loads aceita ambos
+            payload_json = r["payload_json"] or "{}"
 
             next_attempt = attempts + 1
 
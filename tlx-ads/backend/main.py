@@ -1,8 +1,12 @@
+from dataclasses import dataclass
 from datetime import datetime, timezone, timedelta
-from typing import List, Optional
+from typing import Annotated, List, Optional
 
+import json
 import sqlite3
 
+import orjson
+
 import os
 try:
     import stripe
@@ -16,7 +20,7 @@ from fastapi.responses import RedirectResponse
 from fastapi.responses import Response
 
 from auth import create_token_tenant, decode_token, hash_password, verify_password
-from db import get_db, init_db
+from db import close_async_pool, close_pool, get_async_db, get_db, init_db
 from models import (
     AdCreateIn,
     AdOut,
@@ -69,20 +73,20 @@ from models import (
     PlanCheckoutOut,
 )
 
-from audit import write_audit
-from metrics_util import ctr
+from audit import start_audit_writer, stop_audit_writer, write_audit
+from metrics_util import ctr, record_metric_event, start_metric_writer, stop_metric_writer
 from rate_limit_redis import get_rate_limiter
-from rbac import ROLE_ADMIN, ROLE_EDITOR, ROLE_VIEWER, require_role
+from rbac import ROLE_ADMIN, ROLE_EDITOR, ROLE_VIEWER, require_role, role_checker
 from shortener import generate_slug
-from templates_util import render_template
-from token_utils import secure_token
+from templates_util import render_stored_template, render_template, warm_stored_template
+from token_utils import secure_token, secure_tokens
 from utm import add_utm
 
 from saas import (
     check_daily_send_or_raise,
     check_monthly_resource_or_raise,
+    daily_send_remaining,
     increment_daily_send,
-    increment_monthly_resource,
     plan_snapshot,
     set_plan,
     get_stripe_refs,
@@ -90,6 +94,7 @@ from saas import (
 
 from otel import setup_otel
 
+from jobs.cron_run_due import run_due_once
 from jobs.worker_deliveries import process_once as process_deliveries_once
 
 app = FastAPI(title="TLX Ads Platform", version="1.0.0")
@@ -114,7 +119,7 @@ def now_iso() -> str:
     return datetime.now(timezone.utc).replace(microsecond=0).isoformat()
 
 
-def require_user(
+async def require_user(
     credentials: HTTPAuthorizationCredentials | None = Depends(security),
 ) -> dict:
     if credentials is None or credentials.scheme.lower() != "bearer":
@@ -126,7 +131,7 @@ def require_user(
     return payload
 
 
-def require_ctx(user: dict = Depends(require_user)) -> dict:
+async def require_ctx(user: dict = Depends(require_user)) -> dict:
     # tid/role entram via token (multi-tenant). Em modo compat, init_db cria tenant default e memberships.
     try:
         tid = int(user.get("tid") or 0)
@@ -135,8 +140,9 @@ def require_ctx(user: dict = Depends(require_user)) -> dict:
     role = str(user.get("role") or ROLE_VIEWER)
     if tid <= 0:
         try:
-            with get_db() as db:
-                row = db.execute("SELECT id FROM tenants WHERE slug = ?", ("default",)).fetchone()
+            async with get_async_db() as db:
+                cur = await db.execute("SELECT id FROM tenants WHERE slug = ?", ("default",))
+                row = await cur.fetchone()
                 if row:
                     tid = int(row[0])
         except Exception:
@@ -144,6 +150,62 @@ def require_ctx(user: dict = Depends(require_user)) -> dict:
     return {"user_id": int(user["sub"]), "email": str(user.get("email", "")), "tenant_id": tid, "role": role}
 
 
+def _json_rows(rows) -> Response:
+    # Listas só-leitura: o SELECT já traz exatamente as colunas do *Out (str/int/None),
+    # então serializa direto com orjson, sem validar/serializar via response_model.
+    # O modelo continua documentado no OpenAPI via `responses=`.
+    return Response(content=orjson.dumps([dict(r) for r in rows]), media_type="application/json")
+
+
+def _dumps_json(obj) -> bytes:
+    # JSON livre do cliente (meta/payload): orjson recusa int fora de 64 bits, que o json do
+    # stdlib aceita; nesse caso cai no stdlib para não virar 500.
+    try:
+        return orjson.dumps(obj)
+    except TypeError:  # orjson.JSONEncodeError é subclasse de TypeError
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+@dataclass(frozen=True, slots=True)
+class Ctx:
+    tenant_id: int
+    user_id: int
+    role: str
+    email: str
+
+
+async def require_ctx_resolved(ctx: dict = Depends(require_ctx)) -> Ctx:
+    # Coerção feita uma vez por request (tenant <= 0 cai no tenant 1, como nos handlers).
+    tenant_id = int(ctx.get("tenant_id") or 0)
+    if tenant_id <= 0:
+        tenant_id = 1
+    return Ctx(
+        tenant_id=tenant_id,
+        user_id=int(ctx["user_id"]),
+        role=str(ctx.get("role") or ROLE_VIEWER),
+        email=str(ctx.get("email", "")),
+    )
+
+
+_check_editor = role_checker(ROLE_EDITOR)
+_check_viewer = role_checker(ROLE_VIEWER)
+
+
+async def _require_editor(ctx: Ctx = Depends(require_ctx_resolved)) -> Ctx:
+    _check_editor(ctx.role)
+    return ctx
+
+
+async def _require_viewer(ctx: Ctx = Depends(require_ctx_resolved)) -> Ctx:
+    _check_viewer(ctx.role)
+    return ctx
+
+
+# Contexto já resolvido e com papel checado; o handler só declara `ctx: EditorCtx`.
+EditorCtx = Annotated[Ctx, Depends(_require_editor)]
+ViewerCtx = Annotated[Ctx, Depends(_require_viewer)]
+
+
 def _normalize_slug(value: str) -> str:
     v = (value or "").strip().lower()
     v = v.replace(" ", "-")
@@ -250,6 +312,16 @@ PIXEL_GIF_BYTES = (
     b"\x00\x02\x02D\x01\x00;"
 )
 
+# Allowlist do pixel lida uma vez (import) + headers prontos por origin.
+# Cada request ainda ganha seu Response: o CORSMiddleware altera os headers da resposta.
+PIXEL_ALLOWED_ORIGINS = frozenset(o.strip() for o in os.getenv("PIXEL_ALLOWED_ORIGINS", "").split(",") if o.strip())
+_PIXEL_CACHE_CONTROL = "no-store, no-cache, must-revalidate, max-age=0"
+_PIXEL_HEADERS_DEFAULT = {"Cache-Control": _PIXEL_CACHE_CONTROL}
+_PIXEL_HEADERS_BY_ORIGIN = {
+    o: {"Access-Control-Allow-Origin": o, "Vary": "Origin", "Cache-Control": _PIXEL_CACHE_CONTROL}
+    for o in PIXEL_ALLOWED_ORIGINS
+}
+
 
 def _validate_iso8601(value: str) -> None:
     try:
@@ -258,9 +330,24 @@ def _validate_iso8601(value: str) -> None:
         raise HTTPException(status_code=400, detail="scheduled_at must be ISO 8601")
 
 
+# Guarda de campanha para INSERT ... SELECT: valida campaign_id no tenant no próprio INSERT
+# (sem SELECT prévio). Params: (campaign_id, campaign_id, tenant_id). rowcount == 0 -> 404.
+CAMPAIGN_GUARD_SQL = "WHERE ? IS NULL OR EXISTS (SELECT 1 FROM campaigns WHERE id = ? AND tenant_id = ?)"
+
+
 @app.on_event("startup")
 def _startup():
     init_db()
+    start_audit_writer()
+    start_metric_writer()
+
+
+@app.on_event("shutdown")
+async def _shutdown():
+    stop_audit_writer()
+    stop_metric_writer()
+    await close_async_pool()
+    close_pool()
 
 
 @app.get("/health")
@@ -382,13 +469,13 @@ def create_tenant(data: TenantCreateIn, ctx: dict = Depends(require_ctx)):
 
 
 @app.get("/tenants/{tenant_id}/members", response_model=List[MemberOut])
-def list_members(tenant_id: int, ctx: dict = Depends(require_ctx)):
+async def list_members(tenant_id: int, ctx: dict = Depends(require_ctx)):
     _tenant_or_403(ctx, tenant_id)
     role = str(ctx.get("role") or ROLE_VIEWER)
     require_role(role, ROLE_VIEWER)
 
-    with get_db() as db:
-        rows = db.execute(
+    async with get_async_db() as db:
+        rows = await db.execute_fetchall(
             """
             SELECT m.user_id as user_id, u.email as email, m.role as role, m.created_at as created_at
             FROM memberships m
@@ -397,7 +484,7 @@ def list_members(tenant_id: int, ctx: dict = Depends(require_ctx)):
             ORDER BY m.id ASC
             """,
             (tenant_id,),
-        ).fetchall()
+        )
     return [dict(r) for r in rows]
 
 
@@ -435,12 +522,8 @@ def update_member_role(tenant_id: int, user_id: int, data: MemberRoleUpdateIn, c
 
 
 @app.get("/saas/plan")
-def saas_plan(ctx: dict = Depends(require_ctx)):
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_VIEWER)
+def saas_plan(ctx: ViewerCtx):
+    tenant_id = ctx.tenant_id
 
     with get_db() as db:
         return plan_snapshot(db, tenant_id)
@@ -676,17 +759,13 @@ async def stripe_webhook(request: Request):
 
 
 @app.get("/campaigns", response_model=List[CampaignOut])
-def list_campaigns(
-    ctx: dict = Depends(require_ctx),
+async def list_campaigns(
+    ctx: ViewerCtx,
     q: Optional[str] = Query(default=None, max_length=200),
     limit: int = Query(default=50, ge=1, le=200),
     offset: int = Query(default=0, ge=0),
 ):
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_VIEWER)
+    tenant_id = ctx.tenant_id
 
     where = ["tenant_id = ?"]
     params: list[object] = [tenant_id]
@@ -696,8 +775,8 @@ def list_campaigns(
         params.extend([like, like])
     where_sql = " AND ".join(where)
 
-    with get_db() as db:
-        rows = db.execute(
+    async with get_async_db() as db:
+        rows = await db.execute_fetchall(
             f"""
             SELECT id, tenant_id, name, objective, status, start_at, end_at, created_at, updated_at
             FROM campaigns
@@ -706,17 +785,13 @@ def list_campaigns(
             LIMIT ? OFFSET ?
             """,
             tuple(params + [int(limit), int(offset)]),
-        ).fetchall()
+        )
     return [dict(r) for r in rows]
 
 
 @app.post("/campaigns", response_model=CampaignOut)
-def create_campaign(data: CampaignCreateIn, ctx: dict = Depends(require_ctx)):
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_EDITOR)
+def create_campaign(data: CampaignCreateIn, ctx: EditorCtx):
+    tenant_id = ctx.tenant_id
     ts = now_iso()
     if data.start_at:
         _validate_iso8601(str(data.start_at))
@@ -740,17 +815,13 @@ def create_campaign(data: CampaignCreateIn, ctx: dict = Depends(require_ctx)):
             (cid, tenant_id),
         ).fetchone()
 
-    write_audit(tenant_id, int(ctx["user_id"]), "campaigns.create", "campaign", str(cid), {"name": data.name})
+    write_audit(tenant_id, ctx.user_id, "campaigns.create", "campaign", str(cid), {"name": data.name})
     return dict(row)
 
 
 @app.patch("/campaigns/{campaign_id}", response_model=CampaignOut)
-def update_campaign(campaign_id: int, data: CampaignUpdateIn, ctx: dict = Depends(require_ctx)):
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_EDITOR)
+def update_campaign(campaign_id: int, data: CampaignUpdateIn, ctx: EditorCtx):
+    tenant_id = ctx.tenant_id
 
     fields: dict[str, object] = {}
     if data.name is not None:
@@ -789,39 +860,31 @@ def update_campaign(campaign_id: int, data: CampaignUpdateIn, ctx: dict = Depend
             (int(campaign_id), int(tenant_id)),
         ).fetchone()
 
-    write_audit(tenant_id, int(ctx["user_id"]), "campaigns.update", "campaign", str(int(campaign_id)), {"fields": sorted(list(fields.keys()))})
+    write_audit(tenant_id, ctx.user_id, "campaigns.update", "campaign", str(int(campaign_id)), {"fields": sorted(list(fields.keys()))})
     return dict(row)
 
 
 @app.delete("/campaigns/{campaign_id}")
-def delete_campaign(campaign_id: int, ctx: dict = Depends(require_ctx)):
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_EDITOR)
+def delete_campaign(campaign_id: int, ctx: EditorCtx):
+    tenant_id = ctx.tenant_id
 
     with get_db() as db:
         cur = db.execute("DELETE FROM campaigns WHERE id = ? AND tenant_id = ?", (int(campaign_id), int(tenant_id)))
         if cur.rowcount == 0:
             raise HTTPException(status_code=404, detail="Campaign not found")
 
-    write_audit(tenant_id, int(ctx["user_id"]), "campaigns.delete", "campaign", str(int(campaign_id)), {})
+    write_audit(tenant_id, ctx.user_id, "campaigns.delete", "campaign", str(int(campaign_id)), {})
     return {"deleted": True}
 
 
 @app.get("/contacts", response_model=List[ContactOut])
-def list_contacts(
-    ctx: dict = Depends(require_ctx),
+async def list_contacts(
+    ctx: ViewerCtx,
     q: Optional[str] = Query(default=None, max_length=200),
     limit: int = Query(default=50, ge=1, le=200),
     offset: int = Query(default=0, ge=0),
 ):
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_VIEWER)
+    tenant_id = ctx.tenant_id
 
     where = ["tenant_id = ?"]
     params: list[object] = [tenant_id]
@@ -831,8 +894,8 @@ def list_contacts(
         params.extend([like, like, like])
     where_sql = " AND ".join(where)
 
-    with get_db() as db:
-        rows = db.execute(
+    async with get_async_db() as db:
+        rows = await db.execute_fetchall(
             f"""
             SELECT id, tenant_id, name, email, phone, consent_at, meta_json, created_at, updated_at
             FROM contacts
@@ -840,18 +903,14 @@ def list_contacts(
             ORDER BY id DESC
             LIMIT ? OFFSET ?
             """,
-            tuple(params + [int(limit), int(offset)]),
-        ).fetchall()
+            tuple(params + [limit, offset]),
+        )
     return [dict(r) for r in rows]
 
 
 @app.post("/contacts", response_model=ContactOut)
-def create_contact(data: ContactCreateIn, ctx: dict = Depends(require_ctx)):
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_EDITOR)
+def create_contact(data: ContactCreateIn, ctx: EditorCtx):
+    tenant_id = ctx.tenant_id
     ts = now_iso()
 
     email = (data.email or "").strip().lower() or None
@@ -861,9 +920,7 @@ def create_contact(data: ContactCreateIn, ctx: dict = Depends(require_ctx)):
     if data.consent_at:
         _validate_iso8601(str(data.consent_at))
 
-    import json
-
-    meta_json = json.dumps(data.meta, ensure_ascii=False) if data.meta is not None else None
+    meta_json = _dumps_json(data.meta) if data.meta is not None else None
 
     with get_db() as db:
         try:
@@ -886,19 +943,13 @@ def create_contact(data: ContactCreateIn, ctx: dict = Depends(require_ctx)):
             (cid, tenant_id),
         ).fetchone()
 
-    write_audit(tenant_id, int(ctx["user_id"]), "contacts.create", "contact", str(cid), {"email": email, "phone": phone})
+    write_audit(tenant_id, ctx.user_id, "contacts.create", "contact", str(cid), {"email": email, "phone": phone})
     return dict(row)
 
 
 @app.patch("/contacts/{contact_id}", response_model=ContactOut)
-def update_contact(contact_id: int, data: ContactUpdateIn, ctx: dict = Depends(require_ctx)):
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_EDITOR)
-
-    import json
+def update_contact(contact_id: int, data: ContactUpdateIn, ctx: EditorCtx):
+    tenant_id = ctx.tenant_id
 
     fields: dict[str, object] = {}
     if "name" in data.model_fields_set:
@@ -912,14 +963,14 @@ def update_contact(contact_id: int, data: ContactUpdateIn, ctx: dict = Depends(r
             _validate_iso8601(str(data.consent_at))
         fields["consent_at"] = data.consent_at
     if "meta" in data.model_fields_set:
-        fields["meta_json"] = json.dumps(data.meta, ensure_ascii=False) if data.meta is not None else None
+        fields["meta_json"] = _dumps_json(data.meta) if data.meta is not None else None
 
     if not fields:
         raise HTTPException(status_code=400, detail="No fields to update")
     fields["updated_at"] = now_iso()
 
     set_clause = ", ".join([f"{k} = ?" for k in fields.keys()])
-    params = list(fields.values()) + [int(contact_id), int(tenant_id)]
+    params = list(fields.values()) + [contact_id, tenant_id]
 
     with get_db() as db:
         try:
@@ -938,53 +989,41 @@ def update_contact(contact_id: int, data: ContactUpdateIn, ctx: dict = Depends(r
             SELECT id, tenant_id, name, email, phone, consent_at, meta_json, created_at, updated_at
             FROM contacts WHERE id = ? AND tenant_id = ?
             """,
-            (int(contact_id), int(tenant_id)),
+            (contact_id, tenant_id),
         ).fetchone()
 
-    write_audit(tenant_id, int(ctx["user_id"]), "contacts.update", "contact", str(int(contact_id)), {"fields": sorted(list(fields.keys()))})
+    write_audit(tenant_id, ctx.user_id, "contacts.update", "contact", str(contact_id), {"fields": sorted(list(fields.keys()))})
     return dict(row)
 
 
 @app.delete("/contacts/{contact_id}")
-def delete_contact(contact_id: int, ctx: dict = Depends(require_ctx)):
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_EDITOR)
+def delete_contact(contact_id: int, ctx: EditorCtx):
+    tenant_id = ctx.tenant_id
 
     with get_db() as db:
-        cur = db.execute("DELETE FROM contacts WHERE id = ? AND tenant_id = ?", (int(contact_id), int(tenant_id)))
+        cur = db.execute("DELETE FROM contacts WHERE id = ? AND tenant_id = ?", (contact_id, tenant_id))
         if cur.rowcount == 0:
             raise HTTPException(status_code=404, detail="Contact not found")
 
-    write_audit(tenant_id, int(ctx["user_id"]), "contacts.delete", "contact", str(int(contact_id)), {})
+    write_audit(tenant_id, ctx.user_id, "contacts.delete", "contact", str(contact_id), {})
     return {"deleted": True}
 
 
 @app.get("/segments", response_model=List[SegmentOut])
-def list_segments(ctx: dict = Depends(require_ctx)):
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_VIEWER)
+async def list_segments(ctx: ViewerCtx):
+    tenant_id = ctx.tenant_id
 
-    with get_db() as db:
-        rows = db.execute(
+    async with get_async_db() as db:
+        rows = await db.execute_fetchall(
             "SELECT id, tenant_id, name, created_at, updated_at FROM segments WHERE tenant_id = ? ORDER BY id DESC",
             (tenant_id,),
-        ).fetchall()
+        )
     return [dict(r) for r in rows]
 
 
 @app.post("/segments", response_model=SegmentOut)
-def create_segment(data: SegmentCreateIn, ctx: dict = Depends(require_ctx)):
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_EDITOR)
+def create_segment(data: SegmentCreateIn, ctx: EditorCtx):
+    tenant_id = ctx.tenant_id
     ts = now_iso()
 
     with get_db() as db:
@@ -1002,17 +1041,13 @@ def create_segment(data: SegmentCreateIn, ctx: dict = Depends(require_ctx)):
             (sid, tenant_id),
         ).fetchone()
 
-    write_audit(tenant_id, int(ctx["user_id"]), "segments.create", "segment", str(sid), {"name": data.name})
+    write_audit(tenant_id, ctx.user_id, "segments.create", "segment", str(sid), {"name": data.name})
     return dict(row)
 
 
 @app.patch("/segments/{segment_id}", response_model=SegmentOut)
-def update_segment(segment_id: int, data: SegmentUpdateIn, ctx: dict = Depends(require_ctx)):
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_EDITOR)
+def update_segment(segment_id: int, data: SegmentUpdateIn, ctx: EditorCtx):
+    tenant_id = ctx.tenant_id
 
     name = str(data.name or "").strip()
     if not name:
@@ -1022,49 +1057,42 @@ def update_segment(segment_id: int, data: SegmentUpdateIn, ctx: dict = Depends(r
     with get_db() as db:
         cur = db.execute(
             "UPDATE segments SET name = ?, updated_at = ? WHERE id = ? AND tenant_id = ?",
-            (name, ts, int(segment_id), int(tenant_id)),
+            (name, ts, segment_id, tenant_id),
         )
         if cur.rowcount == 0:
             raise HTTPException(status_code=404, detail="Segment not found")
         row = db.execute(
             "SELECT id, tenant_id, name, created_at, updated_at FROM segments WHERE id = ? AND tenant_id = ?",
-            (int(segment_id), int(tenant_id)),
+            (segment_id, tenant_id),
         ).fetchone()
 
-    write_audit(tenant_id, int(ctx["user_id"]), "segments.update", "segment", str(int(segment_id)), {"name": name})
+    write_audit(tenant_id, ctx.user_id, "segments.update", "segment", str(segment_id), {"name": name})
     return dict(row)
 
 
 @app.delete("/segments/{segment_id}")
-def delete_segment(segment_id: int, ctx: dict = Depends(require_ctx)):
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_EDITOR)
+def delete_segment(segment_id: int, ctx: EditorCtx):
+    tenant_id = ctx.tenant_id
 
     with get_db() as db:
-        cur = db.execute("DELETE FROM segments WHERE id = ? AND tenant_id = ?", (int(segment_id), int(tenant_id)))
+        cur = db.execute("DELETE FROM segments WHERE id = ? AND tenant_id = ?", (segment_id, tenant_id))
         if cur.rowcount == 0:
             raise HTTPException(status_code=404, detail="Segment not found")
 
-    write_audit(tenant_id, int(ctx["user_id"]), "segments.delete", "segment", str(int(segment_id)), {})
+    write_audit(tenant_id, ctx.user_id, "segments.delete", "segment", str(segment_id), {})
     return {"deleted": True}
 
 
 @app.get("/segments/{segment_id}/members")
-def list_segment_members(segment_id: int, ctx: dict = Depends(require_ctx)):
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_VIEWER)
+async def list_segment_members(segment_id: int, ctx: ViewerCtx):
+    tenant_id = ctx.tenant_id
 
-    with get_db() as db:
-        seg = db.execute("SELECT id FROM segments WHERE id = ? AND tenant_id = ?", (int(segment_id), int(tenant_id))).fetchone()
+    async with get_async_db() as db:
+        cur = await db.execute("SELECT id FROM segments WHERE id = ? AND tenant_id = ?", (segment_id, tenant_id))
+        seg = await cur.fetchone()
         if not seg:
             raise HTTPException(status_code=404, detail="Segment not found")
-        rows = db.execute(
+        rows = await db.execute_fetchall(
             """
             SELECT c.id, c.name, c.email, c.phone, c.consent_at
             FROM segment_members sm
@@ -1072,67 +1100,55 @@ def list_segment_members(segment_id: int, ctx: dict = Depends(require_ctx)):
             WHERE sm.segment_id = ? AND c.tenant_id = ?
             ORDER BY sm.id DESC
             """,
-            (int(segment_id), int(tenant_id)),
-        ).fetchall()
+            (segment_id, tenant_id),
+        )
     return [dict(r) for r in rows]
 
 
 @app.post("/segments/{segment_id}/members")
-def add_segment_member(segment_id: int, data: SegmentMemberAddIn, ctx: dict = Depends(require_ctx)):
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_EDITOR)
+def add_segment_member(segment_id: int, data: SegmentMemberAddIn, ctx: EditorCtx):
+    tenant_id = ctx.tenant_id
     ts = now_iso()
 
     with get_db() as db:
-        seg = db.execute("SELECT id FROM segments WHERE id = ? AND tenant_id = ?", (int(segment_id), int(tenant_id))).fetchone()
+        seg = db.execute("SELECT id FROM segments WHERE id = ? AND tenant_id = ?", (segment_id, tenant_id)).fetchone()
         if not seg:
             raise HTTPException(status_code=404, detail="Segment not found")
-        contact = db.execute("SELECT id FROM contacts WHERE id = ? AND tenant_id = ?", (int(data.contact_id), int(tenant_id))).fetchone()
+        contact = db.execute("SELECT id FROM contacts WHERE id = ? AND tenant_id = ?", (data.contact_id, tenant_id)).fetchone()
         if not contact:
             raise HTTPException(status_code=404, detail="Contact not found")
 
         db.execute(
             "INSERT OR IGNORE INTO segment_members (segment_id, contact_id, created_at) VALUES (?, ?, ?)",
-            (int(segment_id), int(data.contact_id), ts),
+            (segment_id, data.contact_id, ts),
         )
 
-    write_audit(tenant_id, int(ctx["user_id"]), "segments.add_member", "segment_member", f"{segment_id}:{data.contact_id}", {})
+    write_audit(tenant_id, ctx.user_id, "segments.add_member", "segment_member", f"{segment_id}:{data.contact_id}", {})
     return {"ok": True}
 
 
 @app.delete("/segments/{segment_id}/members/{contact_id}")
-def remove_segment_member(segment_id: int, contact_id: int, ctx: dict = Depends(require_ctx)):
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_EDITOR)
+def remove_segment_member(segment_id: int, contact_id: int, ctx: EditorCtx):
+    tenant_id = ctx.tenant_id
 
     with get_db() as db:
-        seg = db.execute("SELECT id FROM segments WHERE id = ? AND tenant_id = ?", (int(segment_id), int(tenant_id))).fetchone()
+        seg = db.execute("SELECT id FROM segments WHERE id = ? AND tenant_id = ?", (segment_id, tenant_id)).fetchone()
         if not seg:
             raise HTTPException(status_code=404, detail="Segment not found")
         cur = db.execute(
             "DELETE FROM segment_members WHERE segment_id = ? AND contact_id = ?",
-            (int(segment_id), int(contact_id)),
+            (segment_id, contact_id),
         )
         if cur.rowcount == 0:
             raise HTTPException(status_code=404, detail="Member not found")
 
-    write_audit(tenant_id, int(ctx["user_id"]), "segments.remove_member", "segment_member", f"{segment_id}:{contact_id}", {})
+    write_audit(tenant_id, ctx.user_id, "segments.remove_member", "segment_member", f"{segment_id}:{contact_id}", {})
     return {"deleted": True}
 
 
 @app.post("/automation/segment-send", response_model=AutomationSegmentSendOut)
-def automation_segment_send(data: AutomationSegmentSendIn, ctx: dict = Depends(require_ctx)):
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_EDITOR)
+def automation_segment_send(data: AutomationSegmentSendIn, ctx: EditorCtx):
+    tenant_id = ctx.tenant_id
 
     scheduled_at = data.scheduled_at.strip() if data.scheduled_at else None
     if scheduled_at:
@@ -1144,40 +1160,50 @@ def automation_segment_send(data: AutomationSegmentSendIn, ctx: dict = Depends(r
 
     max_batch = int(os.getenv("AUTOMATION_MAX_BATCH", "500"))
     with get_db() as db:
-        seg = db.execute(
-            "SELECT id FROM segments WHERE id = ? AND tenant_id = ?",
-            (int(data.segment_id), int(tenant_id)),
+        # segmento + campanha + template validados num único SELECT
+        refs = db.execute(
+            """
+            SELECT
+              (SELECT 1 FROM segments WHERE id = ? AND tenant_id = ?) AS segment_ok,
+              (SELECT 1 FROM campaigns WHERE id = ? AND tenant_id = ?) AS campaign_ok,
+              (SELECT body FROM templates WHERE id = ? AND tenant_id = ?) AS template_body,
+              (SELECT updated_at FROM templates WHERE id = ? AND tenant_id = ?) AS template_updated_at
+            """,
+            (
+                data.segment_id,
+                tenant_id,
+                data.campaign_id,
+                tenant_id,
+                data.template_id,
+                tenant_id,
+                data.template_id,
+                tenant_id,
+            ),
         ).fetchone()
-        if not seg:
+        if not refs["segment_ok"]:
             raise HTTPException(status_code=404, detail="Segment not found")
-
-        if data.campaign_id is not None:
-            ok = db.execute(
-                "SELECT id FROM campaigns WHERE id = ? AND tenant_id = ?",
-                (int(data.campaign_id), int(tenant_id)),
-            ).fetchone()
-            if not ok:
-                raise HTTPException(status_code=404, detail="Campaign not found")
+        if data.campaign_id is not None and not refs["campaign_ok"]:
+            raise HTTPException(status_code=404, detail="Campaign not found")
 
         if data.template_id is not None:
-            tpl = db.execute(
-                "SELECT body FROM templates WHERE id = ? AND tenant_id = ?",
-                (int(data.template_id), int(tenant_id)),
-            ).fetchone()
-            if not tpl:
+            if refs["template_body"] is None:
                 raise HTTPException(status_code=404, detail="Template not found")
-            body = render_template(str(tpl[0]), variables)
+            body = render_stored_template(data.template_id, refs["template_updated_at"], refs["template_body"], variables)
         elif variables:
             body = render_template(body, variables)
 
-        contacts = db.execute(
-            """
-            SELECT c.id, c.email, c.phone
+        # só a coluna de destino do canal, como tupla simples (sem sqlite3.Row no loop)
+        addr_col = "c.email" if channel == "email" else "c.phone"
+        cur = db.cursor()
+        cur.row_factory = None
+        contacts = cur.execute(
+            f"""
+            SELECT {addr_col}
             FROM segment_members sm
             JOIN contacts c ON c.id = sm.contact_id
             WHERE sm.segment_id = ? AND c.tenant_id = ?
             """,
-            (int(data.segment_id), int(tenant_id)),
+            (data.segment_id, tenant_id),
         ).fetchall()
         if len(contacts) > max_batch:
             raise HTTPException(status_code=400, detail=f"Segmento muito grande. Limite atual: {max_batch}")
@@ -1187,85 +1213,108 @@ def automation_segment_send(data: AutomationSegmentSendIn, ctx: dict = Depends(r
         skipped = 0
         ts = now_iso()
 
-        import json
+        payload_json = orjson.dumps({"body": body, "template_id": data.template_id, "variables": variables})
+        # cota diária lida uma vez; a fila para no primeiro contato acima do limite (failed=1)
+        remaining = daily_send_remaining(db, tenant_id)
 
-        for c in contacts:
-            to_addr = ""
-            if channel == "email":
-                to_addr = str(c["email"] or "").strip()
-            else:
-                to_addr = str(c["phone"] or "").strip()
+        addrs: list[str] = []
+        for (addr,) in contacts:
+            to_addr = (addr or "").strip()
             if not to_addr:
                 skipped += 1
                 continue
 
-            try:
-                check_daily_send_or_raise(db, tenant_id, 1)
-            except HTTPException:
+            if remaining is not None and len(addrs) >= remaining:
                 failed += 1
                 break
 
-            payload_json = json.dumps(
-                {"body": body, "template_id": data.template_id, "variables": variables},
-                ensure_ascii=False,
-            )
-            key = secure_token(16)
-            db.execute(
-                """
-                INSERT INTO deliveries (
-                  tenant_id, campaign_id, channel, to_addr, payload_json, idempotency_key,
-                  status, attempts, max_attempts, next_attempt_at, last_error, created_at, updated_at
-                ) VALUES (?, ?, ?, ?, ?, ?, 'queued', 0, 5, ?, NULL, ?, ?)
-                """,
-                (int(tenant_id), data.campaign_id, channel, to_addr, payload_json, key, scheduled_at, ts, ts),
-            )
-            increment_daily_send(db, tenant_id, channel, 1)
-            queued += 1
+            addrs.append(to_addr)
+
+        # chaves de idempotência geradas de uma vez (uma leitura de os.urandom)
+        rows = [
+            (tenant_id, data.campaign_id, channel, to_addr, payload_json, key, scheduled_at, ts, ts)
+            for to_addr, key in zip(addrs, secure_tokens(len(addrs), 16))
+        ]
+
+        # Transações curtas por lote: segmentos grandes não seguram o lock de escrita
+        # durante todo o envio, e cada lote fica bem abaixo de SQLITE_MAX_VARIABLE_NUMBER.
+        # Lote que falha é desfeito sozinho; os anteriores já estão gravados (e contados), então
+        # o envio para ali e a resposta/auditoria trazem o que de fato entrou na fila.
+        chunk_size = max(1, int(os.getenv("AUTOMATION_INSERT_CHUNK", "500")))
+        error = None
+        db.commit()
+        for i in range(0, len(rows), chunk_size):
+            chunk = rows[i : i + chunk_size]
+            try:
+                db.execute("BEGIN IMMEDIATE")
+                db.executemany(
+                    """
+                    INSERT INTO deliveries (
+                      tenant_id, campaign_id, channel, to_addr, payload_json, idempotency_key,
+                      status, attempts, max_attempts, next_attempt_at, last_error, created_at, updated_at
+                    ) VALUES (?, ?, ?, ?, ?, ?, 'queued', 0, 5, ?, NULL, ?, ?)
+                    """,
+                    chunk,
+                )
+                increment_daily_send(db, tenant_id, channel, len(chunk))
+                db.commit()
+            except sqlite3.Error as e:
+                db.rollback()
+                failed += len(rows) - i
+                error = str(e)
+                break
+            queued += len(chunk)
 
-    write_audit(tenant_id, int(ctx["user_id"]), "automation.segment_send", "segment", str(int(data.segment_id)), {"queued": queued})
+    meta = {"queued": queued}
+    if error is not None:
+        meta.update({"failed": failed, "error": error})
+    write_audit(tenant_id, ctx.user_id, "automation.segment_send", "segment", str(data.segment_id), meta)
     return {"queued": queued, "failed": failed, "skipped": skipped}
 
 
 @app.post("/deliveries", response_model=DeliveryQueueOut)
-def enqueue_delivery(data: DeliveryQueueCreateIn, ctx: dict = Depends(require_ctx)):
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_EDITOR)
+def enqueue_delivery(data: DeliveryQueueCreateIn, ctx: EditorCtx):
+    tenant_id = ctx.tenant_id
 
     ts = now_iso()
-    channel = str(data.channel).strip().lower()
-    to_addr = str(data.to_addr).strip()
+    channel = data.channel.strip().lower()
+    to_addr = data.to_addr.strip()
     key = (data.idempotency_key or secure_token(16)).strip()
 
-    import json
-
-    payload_json = json.dumps(data.payload or {}, ensure_ascii=False)
+    payload_json = _dumps_json(data.payload or {})
 
     with get_db() as db:
-        # valida campaign_id no tenant (se vier)
-        if data.campaign_id is not None:
-            ok = db.execute(
-                "SELECT id FROM campaigns WHERE id = ? AND tenant_id = ?",
-                (int(data.campaign_id), int(tenant_id)),
-            ).fetchone()
-            if not ok:
-                raise HTTPException(status_code=404, detail="Campaign not found")
-
         # Quota diária de envios (contabiliza no enqueue)
         check_daily_send_or_raise(db, tenant_id, 1)
 
         try:
+            # valida campaign_id no tenant (se vier) no próprio INSERT
             cur = db.execute(
-                """
+                f"""
                 INSERT INTO deliveries (
                   tenant_id, campaign_id, channel, to_addr, payload_json, idempotency_key,
                   status, attempts, max_attempts, next_attempt_at, last_error, created_at, updated_at
-                ) VALUES (?, ?, ?, ?, ?, ?, 'queued', 0, 5, ?, NULL, ?, ?)
+                )
+                SELECT ?, ?, ?, ?, ?, ?, 'queued', 0, 5, ?, NULL, ?, ?
+                {CAMPAIGN_GUARD_SQL}
                 """,
-                (int(tenant_id), data.campaign_id, channel, to_addr, payload_json, key, ts, ts, ts),
+                (
+                    tenant_id,
+                    data.campaign_id,
+                    channel,
+                    to_addr,
+                    payload_json,
+                    key,
+                    ts,
+                    ts,
+                    ts,
+                    data.campaign_id,
+                    data.campaign_id,
+                    tenant_id,
+                ),
             )
+            if cur.rowcount == 0:
+                raise HTTPException(status_code=404, detail="Campaign not found")
             did = int(cur.lastrowid)
         except sqlite3.IntegrityError:
             # idempotência: retorna o existente
@@ -1274,7 +1323,7 @@ def enqueue_delivery(data: DeliveryQueueCreateIn, ctx: dict = Depends(require_ct
                 SELECT id, tenant_id, campaign_id, channel, to_addr, status, attempts, max_attempts, next_attempt_at, last_error, created_at, updated_at
                 FROM deliveries WHERE tenant_id = ? AND idempotency_key = ?
                 """,
-                (int(tenant_id), key),
+                (tenant_id, key),
             ).fetchone()
             if not row:
                 raise
@@ -1287,26 +1336,22 @@ def enqueue_delivery(data: DeliveryQueueCreateIn, ctx: dict = Depends(require_ct
             SELECT id, tenant_id, campaign_id, channel, to_addr, status, attempts, max_attempts, next_attempt_at, last_error, created_at, updated_at
             FROM deliveries WHERE id = ? AND tenant_id = ?
             """,
-            (did, int(tenant_id)),
+            (did, tenant_id),
         ).fetchone()
 
-    write_audit(tenant_id, int(ctx["user_id"]), "deliveries.enqueue", "delivery", str(int(row["id"])), {"channel": channel})
+    write_audit(tenant_id, ctx.user_id, "deliveries.enqueue", "delivery", str(int(row["id"])), {"channel": channel})
     return dict(row)
 
 
-@app.get("/deliveries", response_model=List[DeliveryQueueOut])
-def list_deliveries_queue(
-    ctx: dict = Depends(require_ctx),
+@app.get("/deliveries", responses={200: {"model": List[DeliveryQueueOut]}})
+async def list_deliveries_queue(
+    ctx: ViewerCtx,
     status: Optional[str] = Query(default=None, max_length=20),
     campaign_id: Optional[int] = Query(default=None),
     limit: int = Query(default=50, ge=1, le=200),
     offset: int = Query(default=0, ge=0),
 ):
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_VIEWER)
+    tenant_id = ctx.tenant_id
 
     where = ["tenant_id = ?"]
     params: list[object] = [tenant_id]
@@ -1315,11 +1360,11 @@ def list_deliveries_queue(
         params.append(status)
     if campaign_id is not None:
         where.append("campaign_id = ?")
-        params.append(int(campaign_id))
+        params.append(campaign_id)
     where_sql = " AND ".join(where)
 
-    with get_db() as db:
-        rows = db.execute(
+    async with get_async_db() as db:
+        rows = await db.execute_fetchall(
             f"""
             SELECT id, tenant_id, campaign_id, channel, to_addr, status, attempts, max_attempts, next_attempt_at, last_error, created_at, updated_at
             FROM deliveries
@@ -1327,9 +1372,9 @@ def list_deliveries_queue(
             ORDER BY id DESC
             LIMIT ? OFFSET ?
             """,
-            tuple(params + [int(limit), int(offset)]),
-        ).fetchall()
-    return [dict(r) for r in rows]
+            tuple(params + [limit, offset]),
+        )
+    return _json_rows(rows)
 
 
 @app.post("/tenants/{tenant_id}/members/invite-token", response_model=InviteOut)
@@ -1351,7 +1396,7 @@ def invite_member_token(tenant_id: int, data: InviteCreateIn, request: Request,
         raise HTTPException(status_code=400, detail="Invalid role")
 
     token = secure_token(32)
-    expires_at = datetime.now(timezone.utc) + __import__("datetime").timedelta(hours=48)
+    expires_at = datetime.now(timezone.utc) + timedelta(hours=48)
     ts = now_iso()
 
     invite_base = (data.invite_base_url or (_public_web_base() + "/accept-invite")).strip()
@@ -1378,8 +1423,6 @@ def invite_member_token(tenant_id: int, data: InviteCreateIn, request: Request,
             (tenant_id, email, inv_role, token, expires_at.replace(microsecond=0).isoformat(), ts),
         )
 
-        increment_monthly_resource(db, tenant_id, "invites_created", 1)
-
     link = f"{invite_base}?token={token}"
     write_audit(tenant_id, int(ctx["user_id"]), "invite.create", "invite_token", None, {"email": email, "role": inv_role})
 
@@ -1455,7 +1498,7 @@ def request_password_reset(data: PasswordResetRequestIn):
 
     reset_base = (data.reset_base_url or (_public_web_base() + "/reset-password")).strip()
     token = secure_token(32)
-    expires_at = datetime.now(timezone.utc) + __import__("datetime").timedelta(hours=2)
+    expires_at = datetime.now(timezone.utc) + timedelta(hours=2)
     ts = now_iso()
 
     with get_db() as db:
@@ -1512,7 +1555,7 @@ def confirm_password_reset(data: PasswordResetConfirmIn):
 
 
 @app.get("/auth/me", response_model=MeOut)
-def me(ctx: dict = Depends(require_ctx)):
+async def me(ctx: dict = Depends(require_ctx)):
     return {
         "id": int(ctx["user_id"]),
         "email": str(ctx.get("email", "")),
@@ -1521,9 +1564,9 @@ def me(ctx: dict = Depends(require_ctx)):
     }
 
 
-@app.get("/ads", response_model=List[AdOut])
-def list_ads(
-    ctx: dict = Depends(require_ctx),
+@app.get("/ads", responses={200: {"model": List[AdOut]}})
+async def list_ads(
+    ctx: ViewerCtx,
     status: Optional[str] = Query(default=None, max_length=20),
     channel: Optional[str] = Query(default=None, max_length=40),
     campaign_id: Optional[int] = Query(default=None),
@@ -1531,11 +1574,7 @@ def list_ads(
     limit: int = Query(default=50, ge=1, le=200),
     offset: int = Query(default=0, ge=0),
 ):
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_VIEWER)
+    tenant_id = ctx.tenant_id
 
     where = ["tenant_id = ?"]
     params: list[object] = [tenant_id]
@@ -1548,7 +1587,7 @@ def list_ads(
         params.append(channel)
     if campaign_id is not None:
         where.append("campaign_id = ?")
-        params.append(int(campaign_id))
+        params.append(campaign_id)
     if q:
         where.append("(title LIKE ? OR body LIKE ?)")
         like = f"%{q}%"
@@ -1556,8 +1595,8 @@ def list_ads(
 
     where_sql = " AND ".join(where)
 
-    with get_db() as db:
-        rows = db.execute(
+    async with get_async_db() as db:
+        rows = await db.execute_fetchall(
             f"""
             SELECT id, tenant_id, title, body, rendered_body, target_url, channel, target, campaign_id, status, scheduled_at, created_at, updated_at
             FROM ads
@@ -1566,52 +1605,40 @@ def list_ads(
             LIMIT ? OFFSET ?
             """,
             tuple(params + [limit, offset]),
-        ).fetchall()
+        )
 
-    return [dict(r) for r in rows]
+    return _json_rows(rows)
 
 
 @app.post("/ads", response_model=AdOut)
-def create_ad(data: AdCreateIn, ctx: dict = Depends(require_ctx)):
-    user_id = int(ctx["user_id"])
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_EDITOR)
+def create_ad(data: AdCreateIn, ctx: EditorCtx):
+    user_id = ctx.user_id
+    tenant_id = ctx.tenant_id
     ts = now_iso()
 
-    import json
-
     variables = data.variables or {}
     rendered = None
 
     with get_db() as db:
         check_monthly_resource_or_raise(db, tenant_id, "ads_created", 1)
 
-        if data.campaign_id is not None:
-            ok = db.execute(
-                "SELECT id FROM campaigns WHERE id = ? AND tenant_id = ?",
-                (int(data.campaign_id), int(tenant_id)),
-            ).fetchone()
-            if not ok:
-                raise HTTPException(status_code=404, detail="Campaign not found")
-
         if data.template_id is not None:
             tpl = db.execute(
-                "SELECT body FROM templates WHERE id = ? AND tenant_id = ?",
-                (int(data.template_id), tenant_id),
+                "SELECT body, updated_at FROM templates WHERE id = ? AND tenant_id = ?",
+                (data.template_id, tenant_id),
             ).fetchone()
             if not tpl:
                 raise HTTPException(status_code=404, detail="Template not found")
-            rendered = render_template(str(tpl[0]), variables)
+            rendered = render_stored_template(data.template_id, tpl["updated_at"], tpl["body"], variables)
         elif variables:
             rendered = render_template(data.body, variables)
 
+        # valida campaign_id no tenant (se vier) no próprio INSERT
         cur = db.execute(
-            """
+            f"""
             INSERT INTO ads (tenant_id, owner_user_id, title, body, rendered_body, target_url, channel, target, campaign_id, template_id, variables_json, status, scheduled_at, created_at, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'draft', NULL, ?, ?)
+            SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'draft', NULL, ?, ?
+            {CAMPAIGN_GUARD_SQL}
             """,
             (
                 tenant_id,
@@ -1624,11 +1651,16 @@ def create_ad(data: AdCreateIn, ctx: dict = Depends(require_ctx)):
                 data.target,
                 data.campaign_id,
                 data.template_id,
-                json.dumps(variables, ensure_ascii=False) if variables else None,
+                orjson.dumps(variables) if variables else None,
                 ts,
                 ts,
+                data.campaign_id,
+                data.campaign_id,
+                tenant_id,
             ),
         )
+        if cur.rowcount == 0:
+            raise HTTPException(status_code=404, detail="Campaign not found")
         ad_id = cur.lastrowid
         row = db.execute(
             """
@@ -1638,21 +1670,15 @@ def create_ad(data: AdCreateIn, ctx: dict = Depends(require_ctx)):
             (ad_id, tenant_id),
         ).fetchone()
 
-        increment_monthly_resource(db, tenant_id, "ads_created", 1)
-
-    write_audit(tenant_id, user_id, "ads.create", "ad", str(int(ad_id)), {"channel": data.channel})
+    write_audit(tenant_id, user_id, "ads.create", "ad", str(ad_id), {"channel": data.channel})
 
     return dict(row)
 
 
 @app.patch("/ads/{ad_id}", response_model=AdOut)
-def update_ad(ad_id: int, data: AdUpdateIn, ctx: dict = Depends(require_ctx)):
-    user_id = int(ctx["user_id"])
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_EDITOR)
+def update_ad(ad_id: int, data: AdUpdateIn, ctx: EditorCtx):
+    user_id = ctx.user_id
+    tenant_id = ctx.tenant_id
 
     fields = {}
     if data.title is not None:
@@ -1678,19 +1704,14 @@ def update_ad(ad_id: int, data: AdUpdateIn, ctx: dict = Depends(require_ctx)):
 
     variables = data.variables or {}
     if "variables" in data.model_fields_set:
-        # guardamos só a string JSON para manter a tabela simples (sem ORM aqui)
-        import json
-
-        fields["variables_json"] = json.dumps(variables, ensure_ascii=False)
+        # JSON em bytes (orjson) direto na coluna; leitura aceita bytes ou str (linhas antigas)
+        fields["variables_json"] = orjson.dumps(variables)
 
     if not fields:
         raise HTTPException(status_code=400, detail="No fields to update")
 
     fields["updated_at"] = now_iso()
 
-    set_clause = ", ".join([f"{k} = ?" for k in fields.keys()])
-    params = list(fields.values()) + [ad_id, user_id]
-
     with get_db() as db:
         current = db.execute(
             "SELECT id, status, scheduled_at, body, template_id, variables_json FROM ads WHERE id = ? AND tenant_id = ?",
@@ -1719,30 +1740,31 @@ def update_ad(ad_id: int, data: AdUpdateIn, ctx: dict = Depends(require_ctx)):
         # Renderização (quando body/template/variables mudam)
         will_rerender = any(k in fields for k in ("body", "template_id", "variables_json"))
         if will_rerender:
-            import json
-
             body = str(fields.get("body") or current["body"])
             tpl_id = fields.get("template_id") if "template_id" in fields else current["template_id"]
 
             vars_json = fields.get("variables_json") if "variables_json" in fields else current["variables_json"]
             try:
-                vars_obj = json.loads(vars_json) if vars_json else {}
+                vars_obj = orjson.loads(vars_json) if vars_json else {}
             except Exception:
                 vars_obj = {}
 
             rendered = None
             if tpl_id is not None:
                 tpl = db.execute(
-                    "SELECT body FROM templates WHERE id = ? AND tenant_id = ?",
+                    "SELECT body, updated_at FROM templates WHERE id = ? AND tenant_id = ?",
                     (int(tpl_id), tenant_id),
                 ).fetchone()
                 if not tpl:
                     raise HTTPException(status_code=404, detail="Template not found")
-                rendered = render_template(str(tpl[0]), vars_obj)
+                rendered = render_stored_template(int(tpl_id), tpl["updated_at"], tpl["body"], vars_obj)
             elif vars_obj:
                 rendered = render_template(body, vars_obj)
             fields["rendered_body"] = rendered
 
+        # SET montado depois do render: rendered_body fica gravado na linha (GET /ads só lê a coluna)
+        set_clause = ", ".join([f"{k} = ?" for k in fields.keys()])
+        params = list(fields.values()) + [ad_id, tenant_id]
         db.execute(
             f"UPDATE ads SET {set_clause} WHERE id = ? AND tenant_id = ?",
             tuple(params),
@@ -1762,13 +1784,9 @@ def update_ad(ad_id: int, data: AdUpdateIn, ctx: dict = Depends(require_ctx)):
 
 
 @app.delete("/ads/{ad_id}")
-def delete_ad(ad_id: int, ctx: dict = Depends(require_ctx)):
-    user_id = int(ctx["user_id"])
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_EDITOR)
+def delete_ad(ad_id: int, ctx: EditorCtx):
+    user_id = ctx.user_id
+    tenant_id = ctx.tenant_id
 
     with get_db() as db:
         cur = db.execute(
@@ -1787,18 +1805,13 @@ def delete_ad(ad_id: int, ctx: dict = Depends(require_ctx)):
 def schedule_ad(
     ad_id: int,
     scheduled_at: str,
-    user: dict = Depends(require_user),
+    ctx: EditorCtx,
 ):
     """
     Agendar um anúncio (scheduled_at em ISO 8601 UTC, ex: 2026-01-11T15:00:00+00:00)
     """
-    ctx = require_ctx(user)
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    user_id = int(ctx["user_id"])
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_EDITOR)
+    tenant_id = ctx.tenant_id
+    user_id = ctx.user_id
 
     _validate_iso8601(scheduled_at)
 
@@ -1827,42 +1840,36 @@ def schedule_ad(
     return dict(row)
 
 
-@app.get("/ads/{ad_id}/deliveries", response_model=List[DeliveryOut])
-def list_deliveries(ad_id: int, ctx: dict = Depends(require_ctx)):
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_VIEWER)
-
-    with get_db() as db:
-        exists = db.execute(
-            "SELECT id FROM ads WHERE id = ? AND tenant_id = ?",
-            (ad_id, tenant_id),
-        ).fetchone()
-        if not exists:
-            raise HTTPException(status_code=404, detail="Ad not found")
+@app.get("/ads/{ad_id}/deliveries", responses={200: {"model": List[DeliveryOut]}})
+async def list_deliveries(ad_id: int, ctx: ViewerCtx):
+    tenant_id = ctx.tenant_id
 
-        rows = db.execute(
+    async with get_async_db() as db:
+        # Escopo do tenant no próprio SELECT; o probe do ad só roda quando a lista vem vazia.
+        rows = await db.execute_fetchall(
             """
-            SELECT id, delivered_at, result, details
-            FROM ad_deliveries
-            WHERE ad_id = ?
-            ORDER BY id DESC
+            SELECT d.id, d.delivered_at, d.result, d.details
+            FROM ad_deliveries d
+            WHERE d.ad_id = ?
+              AND EXISTS (SELECT 1 FROM ads a WHERE a.id = d.ad_id AND a.tenant_id = ?)
+            ORDER BY d.id DESC
             """,
-            (ad_id,),
-        ).fetchall()
+            (ad_id, tenant_id),
+        )
+        if not rows:
+            cur = await db.execute(
+                "SELECT 1 FROM ads WHERE id = ? AND tenant_id = ?",
+                (ad_id, tenant_id),
+            )
+            if not await cur.fetchone():
+                raise HTTPException(status_code=404, detail="Ad not found")
 
-    return [dict(r) for r in rows]
+    return _json_rows(rows)
 
 
 @app.post("/templates", response_model=TemplateOut)
-def create_template(data: TemplateCreateIn, ctx: dict = Depends(require_ctx)):
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_EDITOR)
+def create_template(data: TemplateCreateIn, ctx: EditorCtx):
+    tenant_id = ctx.tenant_id
     ts = now_iso()
 
     with get_db() as db:
@@ -1878,35 +1885,26 @@ def create_template(data: TemplateCreateIn, ctx: dict = Depends(require_ctx)):
             (tpl_id, tenant_id),
         ).fetchone()
 
-        increment_monthly_resource(db, tenant_id, "templates_created", 1)
-
-    write_audit(tenant_id, int(ctx["user_id"]), "templates.create", "template", str(int(tpl_id)), {"name": data.name})
+    warm_stored_template(tpl_id, row["updated_at"], row["body"])
+    write_audit(tenant_id, ctx.user_id, "templates.create", "template", str(int(tpl_id)), {"name": data.name})
     return dict(row)
 
 
 @app.get("/templates", response_model=List[TemplateOut])
-def list_templates(ctx: dict = Depends(require_ctx)):
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_VIEWER)
+async def list_templates(ctx: ViewerCtx):
+    tenant_id = ctx.tenant_id
 
-    with get_db() as db:
-        rows = db.execute(
+    async with get_async_db() as db:
+        rows = await db.execute_fetchall(
             "SELECT id, name, body, updated_at FROM templates WHERE tenant_id = ? ORDER BY id DESC",
             (tenant_id,),
-        ).fetchall()
+        )
     return [dict(r) for r in rows]
 
 
 @app.post("/templates/preview", response_model=TemplatePreviewOut)
-def preview_template(data: TemplatePreviewIn, ctx: dict = Depends(require_ctx)):
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_VIEWER)
+def preview_template(data: TemplatePreviewIn, ctx: ViewerCtx):
+    tenant_id = ctx.tenant_id
 
     variables = data.variables or {}
     rendered = render_template(data.body, variables)
@@ -1914,12 +1912,8 @@ def preview_template(data: TemplatePreviewIn, ctx: dict = Depends(require_ctx)):
 
 
 @app.delete("/templates/{tpl_id}")
-def delete_template(tpl_id: int, ctx: dict = Depends(require_ctx)):
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_EDITOR)
+def delete_template(tpl_id: int, ctx: EditorCtx):
+    tenant_id = ctx.tenant_id
 
     with get_db() as db:
         cur = db.execute(
@@ -1929,17 +1923,13 @@ def delete_template(tpl_id: int, ctx: dict = Depends(require_ctx)):
         if cur.rowcount == 0:
             raise HTTPException(status_code=404, detail="Template not found")
 
-    write_audit(tenant_id, int(ctx["user_id"]), "templates.delete", "template", str(int(tpl_id)), {})
+    write_audit(tenant_id, ctx.user_id, "templates.delete", "template", str(int(tpl_id)), {})
     return {"deleted": True}
 
 
 @app.post("/links", response_model=LinkOut)
-def create_link(data: LinkCreateIn, ctx: dict = Depends(require_ctx)):
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_EDITOR)
+def create_link(data: LinkCreateIn, ctx: EditorCtx):
+    tenant_id = ctx.tenant_id
     ts = now_iso()
 
     # UTM opcional
@@ -1965,42 +1955,45 @@ def create_link(data: LinkCreateIn, ctx: dict = Depends(require_ctx)):
             if not ok:
                 raise HTTPException(status_code=404, detail="Ad not found")
 
-        slug = generate_slug(7)
-        for _ in range(10):
-            try:
-                db.execute(
-                    "INSERT INTO short_links (tenant_id, ad_id, slug, destination_url, created_at) VALUES (?, ?, ?, ?, ?)",
-                    (tenant_id, data.ad_id, slug, dest, ts),
-                )
+        # Colisão resolvida no SQL (DO NOTHING -> sem linha no RETURNING), sem exceção no fluxo.
+        slug = None
+        # Candidatos gerados sob demanda: o caminho comum (sem colisão) custa um único slug.
+        for attempt in range(10):
+            candidate = generate_slug(7 if attempt == 0 else 8)
+            row = db.execute(
+                """
+                INSERT INTO short_links (tenant_id, ad_id, slug, destination_url, created_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(tenant_id, slug) DO NOTHING
+                RETURNING slug
+                """,
+                (tenant_id, data.ad_id, candidate, dest, ts),
+            ).fetchone()
+            if row:
+                slug = row["slug"]
                 break
-            except sqlite3.IntegrityError:
-                slug = generate_slug(8)
-
-        increment_monthly_resource(db, tenant_id, "links_created", 1)
+        if slug is None:
+            raise HTTPException(status_code=503, detail="Could not allocate slug")
 
-    write_audit(tenant_id, int(ctx["user_id"]), "links.create", "short_link", slug, {"ad_id": data.ad_id})
+    write_audit(tenant_id, ctx.user_id, "links.create", "short_link", slug, {"ad_id": data.ad_id})
     return {"slug": slug, "destination_url": dest}
 
 
 @app.get("/r/{slug}")
 def redirect_short_link(slug: str):
-    # Público (sem auth): registra click e redireciona
+    # Público (sem auth): registra click (em lote, fora do request) e redireciona
     with get_db() as db:
         row = db.execute(
             "SELECT id, tenant_id, destination_url, ad_id FROM short_links WHERE slug = ?",
             (slug,),
         ).fetchone()
-        if not row:
-            raise HTTPException(status_code=404, detail="Not found")
-
-        link_id = int(row["id"])
-        tenant_id = int(row["tenant_id"])
-        ad_id = int(row["ad_id"]) if row["ad_id"] is not None else None
+    if not row:
+        raise HTTPException(status_code=404, detail="Not found")
 
-        db.execute(
-            "INSERT INTO metric_events (tenant_id, ad_id, link_id, event_type, value, meta_json, created_at) VALUES (?, ?, ?, 'click', 1, NULL, ?)",
-            (tenant_id, ad_id, link_id, now_iso()),
-        )
+    link_id = int(row["id"])
+    tenant_id = int(row["tenant_id"])
+    ad_id = int(row["ad_id"]) if row["ad_id"] is not None else None
+    record_metric_event(tenant_id, ad_id, link_id, "click")
 
     return RedirectResponse(url=str(row["destination_url"]), status_code=307)
 
@@ -2013,39 +2006,29 @@ def pixel_impression(
     origin: Optional[str] = Header(default=None),
 ):
     # Endpoint público: registra impressão e devolve 1x1 gif.
-    allowed_raw = os.getenv("PIXEL_ALLOWED_ORIGINS", "")
-    allowed = [o.strip() for o in allowed_raw.split(",") if o.strip()]
-
     # Se existir Origin e NÃO estiver allowlisted, não registra (mas devolve o pixel)
     can_record = True
-    if origin and allowed and origin not in allowed:
+    if origin and PIXEL_ALLOWED_ORIGINS and origin not in PIXEL_ALLOWED_ORIGINS:
         can_record = False
 
     link_id = None
     if can_record:
-        with get_db() as db:
-            if link_slug:
+        if link_slug:
+            with get_db() as db:
                 link = db.execute(
                     "SELECT id, tenant_id, ad_id FROM short_links WHERE slug = ?",
                     (link_slug,),
                 ).fetchone()
-                if link:
-                    link_id = int(link["id"])
-                    tenant_id = int(link["tenant_id"])
-                    if ad_id is None and link["ad_id"] is not None:
-                        ad_id = int(link["ad_id"])
+            if link:
+                link_id = int(link["id"])
+                tenant_id = int(link["tenant_id"])
+                if ad_id is None and link["ad_id"] is not None:
+                    ad_id = int(link["ad_id"])
 
-            db.execute(
-                "INSERT INTO metric_events (tenant_id, ad_id, link_id, event_type, value, meta_json, created_at) VALUES (?, ?, ?, 'impression', 1, NULL, ?)",
-                (int(tenant_id), int(ad_id) if ad_id is not None else None, int(link_id) if link_id else None, now_iso()),
-            )
+        record_metric_event(tenant_id, ad_id, link_id, "impression")
 
-    resp = Response(content=PIXEL_GIF_BYTES, media_type="image/gif")
-    if origin and origin in allowed:
-        resp.headers["Access-Control-Allow-Origin"] = origin
-        resp.headers["Vary"] = "Origin"
-    resp.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
-    return resp
+    headers = _PIXEL_HEADERS_BY_ORIGIN.get(origin, _PIXEL_HEADERS_DEFAULT) if origin else _PIXEL_HEADERS_DEFAULT
+    return Response(content=PIXEL_GIF_BYTES, media_type="image/gif", headers=headers)
 
 
 @app.post("/events/conversion")
@@ -2053,22 +2036,15 @@ def event_conversion(slug: str):
     # Público: registra conversão (MVP). Em produção, valide assinatura/CSRF, etc.
     with get_db() as db:
         row = db.execute("SELECT id, tenant_id, ad_id FROM short_links WHERE slug = ?", (slug,)).fetchone()
-        if not row:
-            raise HTTPException(status_code=404, detail="Not found")
-        db.execute(
-            "INSERT INTO metric_events (tenant_id, ad_id, link_id, event_type, value, meta_json, created_at) VALUES (?, ?, ?, 'conversion', 1, NULL, ?)",
-            (int(row["tenant_id"]), int(row["ad_id"]) if row["ad_id"] is not None else None, int(row["id"]), now_iso()),
-        )
+    if not row:
+        raise HTTPException(status_code=404, detail="Not found")
+    record_metric_event(int(row["tenant_id"]), int(row["ad_id"]) if row["ad_id"] is not None else None, int(row["id"]), "conversion")
     return {"ok": True}
 
 
 @app.get("/dashboard", response_model=DashboardOut)
-def dashboard(ctx: dict = Depends(require_ctx)):
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_VIEWER)
+def dashboard(ctx: ViewerCtx):
+    tenant_id = ctx.tenant_id
 
     with get_db() as db:
         clicks = db.execute(
@@ -2093,62 +2069,60 @@ def dashboard(ctx: dict = Depends(require_ctx)):
 
 
 @app.get("/dashboard/history", response_model=DashboardHistoryOut)
-def dashboard_history(ctx: dict = Depends(require_ctx), days: int = Query(default=14, ge=1, le=90)):
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_VIEWER)
+def dashboard_history(ctx: ViewerCtx, days: int = Query(default=14, ge=1, le=90)):
+    tenant_id = ctx.tenant_id
 
     now = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
     start = (now - timedelta(days=days - 1)).date().isoformat()
 
+    # Um dia por linha (gerado no SQL, já com zeros) + pivot por event_type via CASE.
+    # Sem impressões no dia, o proxy de impressões é o número de clicks.
     with get_db() as db:
         rows = db.execute(
             """
-            SELECT substr(created_at, 1, 10) as day, event_type, COALESCE(SUM(value),0) as total
-            FROM metric_events
-            WHERE tenant_id = ? AND created_at >= ?
-            GROUP BY day, event_type
-            ORDER BY day ASC
+            WITH RECURSIVE d(day) AS (
+              SELECT date(?)
+              UNION ALL
+              SELECT date(day, '+1 day') FROM d WHERE day < date(?)
+            ),
+            agg AS (
+              SELECT substr(created_at, 1, 10) AS day,
+                     SUM(CASE WHEN event_type = 'click' THEN value ELSE 0 END) AS clicks,
+                     SUM(CASE WHEN event_type = 'conversion' THEN value ELSE 0 END) AS conversions,
+                     SUM(CASE WHEN event_type = 'impression' THEN value ELSE 0 END) AS impressions
+              FROM metric_events
+              WHERE tenant_id = ? AND created_at >= ?
+              GROUP BY day
+            )
+            SELECT d.day AS day,
+                   COALESCE(agg.clicks, 0) AS clicks,
+                   COALESCE(agg.conversions, 0) AS conversions,
+                   COALESCE(NULLIF(agg.impressions, 0), agg.clicks, 0) AS impressions
+            FROM d
+            LEFT JOIN agg ON agg.day = d.day
+            ORDER BY d.day ASC
             """,
-            (tenant_id, start),
+            (start, now.date().isoformat(), tenant_id, start),
         ).fetchall()
 
-    by_day: dict[str, dict[str, int]] = {}
-    for r in rows:
-        day = str(r["day"])
-        by_day.setdefault(day, {"click": 0, "conversion": 0, "impression": 0})
-        by_day[day][str(r["event_type"] or "")] = int(r["total"] or 0)
-
-    points: list[DashboardHistoryPoint] = []
-    for i in range(days):
-        d = (now - timedelta(days=days - 1 - i)).date().isoformat()
-        stats = by_day.get(d, {"click": 0, "conversion": 0, "impression": 0})
-        clicks = int(stats.get("click") or 0)
-        conv = int(stats.get("conversion") or 0)
-        impressions = int(stats.get("impression") or clicks)
-        ctr_proxy = float(ctr(clicks, impressions))
-        points.append(
-            DashboardHistoryPoint(
-                day=d,
-                clicks=clicks,
-                conversions=conv,
-                impressions_proxy=impressions,
-                ctr_proxy=ctr_proxy,
-            )
+    # Valores já tipados pelo SQL/int(): model_construct evita a validação na montagem
+    # (o response_model valida a saída uma vez de qualquer forma).
+    points = [
+        DashboardHistoryPoint.model_construct(
+            day=r["day"],
+            clicks=r["clicks"],
+            conversions=r["conversions"],
+            impressions_proxy=r["impressions"],
+            ctr_proxy=float(ctr(r["clicks"], r["impressions"])),
         )
-
+        for r in rows
+    ]
     return {"days": int(days), "points": points}
 
 
 @app.get("/dashboard/channels", response_model=DashboardChannelsOut)
-def dashboard_channels(ctx: dict = Depends(require_ctx), days: int = Query(default=14, ge=1, le=90)):
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_VIEWER)
+def dashboard_channels(ctx: ViewerCtx, days: int = Query(default=14, ge=1, le=90)):
+    tenant_id = ctx.tenant_id
 
     now = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
     start = (now - timedelta(days=days - 1)).date().isoformat()
@@ -2156,31 +2130,28 @@ def dashboard_channels(ctx: dict = Depends(require_ctx), days: int = Query(defau
     with get_db() as db:
         rows = db.execute(
             """
-            SELECT a.channel as channel, me.event_type as event_type, COALESCE(SUM(me.value),0) as total
+            SELECT COALESCE(a.channel, '') AS channel,
+                   SUM(CASE WHEN me.event_type = 'click' THEN me.value ELSE 0 END) AS clicks,
+                   SUM(CASE WHEN me.event_type = 'conversion' THEN me.value ELSE 0 END) AS conversions,
+                   SUM(CASE WHEN me.event_type = 'impression' THEN me.value ELSE 0 END) AS impressions
             FROM metric_events me
             JOIN ads a ON a.id = me.ad_id
             WHERE me.tenant_id = ? AND me.created_at >= ?
-            GROUP BY a.channel, me.event_type
+            GROUP BY a.channel
+            ORDER BY channel
             """,
             (tenant_id, start),
         ).fetchall()
 
-    by_channel: dict[str, dict[str, int]] = {}
-    for r in rows:
-        ch = str(r["channel"] or "")
-        by_channel.setdefault(ch, {"click": 0, "conversion": 0, "impression": 0})
-        by_channel[ch][str(r["event_type"] or "")] = int(r["total"] or 0)
-
     points: list[DashboardChannelPoint] = []
-    for ch, stats in sorted(by_channel.items(), key=lambda x: x[0]):
-        clicks = int(stats.get("click") or 0)
-        conv = int(stats.get("conversion") or 0)
-        impressions = int(stats.get("impression") or clicks)
+    for r in rows:
+        clicks = int(r["clicks"] or 0)
+        impressions = int(r["impressions"] or clicks)
         points.append(
-            DashboardChannelPoint(
-                channel=ch,
+            DashboardChannelPoint.model_construct(
+                channel=str(r["channel"]),
                 clicks=clicks,
-                conversions=conv,
+                conversions=int(r["conversions"] or 0),
                 impressions_proxy=impressions,
                 ctr_proxy=float(ctr(clicks, impressions)),
             )
@@ -2190,82 +2161,53 @@ def dashboard_channels(ctx: dict = Depends(require_ctx), days: int = Query(defau
 
 
 @app.get("/dashboard/campaigns", response_model=DashboardCampaignsOut)
-def dashboard_campaigns(ctx: dict = Depends(require_ctx), days: int = Query(default=30, ge=1, le=180)):
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_VIEWER)
+def dashboard_campaigns(ctx: ViewerCtx, days: int = Query(default=30, ge=1, le=180)):
+    tenant_id = ctx.tenant_id
 
     now = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
     start = (now - timedelta(days=days - 1)).date().isoformat()
 
     with get_db() as db:
+        # Pivot por status e ordenação (total desc, nome desc) feitos no SQLite.
         rows = db.execute(
             """
-            SELECT d.campaign_id as campaign_id, c.name as campaign_name, d.status as status, COUNT(1) as total
+            SELECT d.campaign_id AS campaign_id,
+                   COALESCE(c.name, 'Sem campanha') AS campaign_name,
+                   COALESCE(SUM(d.status = 'sent'), 0) AS sent,
+                   COALESCE(SUM(d.status = 'failed'), 0) AS failed,
+                   COALESCE(SUM(d.status = 'retrying'), 0) AS retrying,
+                   COALESCE(SUM(d.status = 'queued'), 0) AS queued,
+                   COALESCE(SUM(d.status = 'sending'), 0) AS sending,
+                   COALESCE(SUM(d.status IN ('sent', 'failed', 'retrying', 'queued', 'sending')), 0) AS total
             FROM deliveries d
             LEFT JOIN campaigns c ON c.id = d.campaign_id
             WHERE d.tenant_id = ? AND d.created_at >= ?
-            GROUP BY d.campaign_id, c.name, d.status
+            GROUP BY d.campaign_id
+            ORDER BY total DESC, campaign_name DESC
             """,
             (tenant_id, start),
         ).fetchall()
 
-    by_campaign: dict[str, dict[str, object]] = {}
-    for r in rows:
-        cid = r["campaign_id"]
-        key = str(cid or 0)
-        name = str(r["campaign_name"] or "Sem campanha")
-        by_campaign.setdefault(
-            key,
-            {
-                "campaign_id": int(cid) if cid is not None else None,
-                "campaign_name": name,
-                "sent": 0,
-                "failed": 0,
-                "retrying": 0,
-                "queued": 0,
-                "sending": 0,
-            },
-        )
-        status = str(r["status"] or "")
-        total = int(r["total"] or 0)
-        if status in ("sent", "failed", "retrying", "queued", "sending"):
-            by_campaign[key][status] = int(by_campaign[key][status]) + total
-
-    points: list[DashboardCampaignPoint] = []
-    for _, data in by_campaign.items():
-        sent = int(data["sent"])
-        failed = int(data["failed"])
-        retrying = int(data["retrying"])
-        queued = int(data["queued"])
-        sending = int(data["sending"])
-        total = sent + failed + retrying + queued + sending
-        points.append(
-            DashboardCampaignPoint(
-                campaign_id=data["campaign_id"],
-                campaign_name=str(data["campaign_name"]),
-                total=total,
-                sent=sent,
-                failed=failed,
-                retrying=retrying,
-                queued=queued,
-                sending=sending,
-            )
+    points = [
+        DashboardCampaignPoint.model_construct(
+            campaign_id=r["campaign_id"],
+            campaign_name=str(r["campaign_name"]),
+            total=int(r["total"]),
+            sent=int(r["sent"]),
+            failed=int(r["failed"]),
+            retrying=int(r["retrying"]),
+            queued=int(r["queued"]),
+            sending=int(r["sending"]),
         )
+        for r in rows
+    ]
 
-    points.sort(key=lambda p: (p.total, p.campaign_name), reverse=True)
     return {"days": int(days), "points": points}
 
 
 @app.get("/dashboard/campaign-conversions", response_model=DashboardCampaignConvOut)
-def dashboard_campaign_conversions(ctx: dict = Depends(require_ctx), days: int = Query(default=30, ge=1, le=180)):
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_VIEWER)
+def dashboard_campaign_conversions(ctx: ViewerCtx, days: int = Query(default=30, ge=1, le=180)):
+    tenant_id = ctx.tenant_id
 
     now = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
     start = (now - timedelta(days=days - 1)).date().isoformat()
@@ -2273,103 +2215,68 @@ def dashboard_campaign_conversions(ctx: dict = Depends(require_ctx), days: int =
     with get_db() as db:
         rows = db.execute(
             """
-            SELECT a.campaign_id as campaign_id, c.name as campaign_name, me.event_type as event_type, COALESCE(SUM(me.value),0) as total
+            SELECT a.campaign_id AS campaign_id,
+                   COALESCE(c.name, 'Sem campanha') AS campaign_name,
+                   SUM(CASE WHEN me.event_type = 'click' THEN me.value ELSE 0 END) AS clicks,
+                   SUM(CASE WHEN me.event_type = 'conversion' THEN me.value ELSE 0 END) AS conversions
             FROM metric_events me
             JOIN ads a ON a.id = me.ad_id
             LEFT JOIN campaigns c ON c.id = a.campaign_id
             WHERE me.tenant_id = ? AND me.created_at >= ?
-            GROUP BY a.campaign_id, c.name, me.event_type
+            GROUP BY a.campaign_id
+            ORDER BY conversions DESC, clicks DESC, campaign_name DESC
             """,
             (tenant_id, start),
         ).fetchall()
 
-    by_campaign: dict[str, dict[str, object]] = {}
-    for r in rows:
-        cid = r["campaign_id"]
-        key = str(cid or 0)
-        name = str(r["campaign_name"] or "Sem campanha")
-        by_campaign.setdefault(
-            key,
-            {
-                "campaign_id": int(cid) if cid is not None else None,
-                "campaign_name": name,
-                "click": 0,
-                "conversion": 0,
-            },
-        )
-        et = str(r["event_type"] or "")
-        if et in ("click", "conversion"):
-            by_campaign[key][et] = int(by_campaign[key][et]) + int(r["total"] or 0)
-
-    points: list[DashboardCampaignConvPoint] = []
-    for _, data in by_campaign.items():
-        points.append(
-            DashboardCampaignConvPoint(
-                campaign_id=data["campaign_id"],
-                campaign_name=str(data["campaign_name"]),
-                clicks=int(data["click"]),
-                conversions=int(data["conversion"]),
-            )
+    points = [
+        DashboardCampaignConvPoint.model_construct(
+            campaign_id=r["campaign_id"],
+            campaign_name=str(r["campaign_name"]),
+            clicks=int(r["clicks"] or 0),
+            conversions=int(r["conversions"] or 0),
         )
+        for r in rows
+    ]
 
-    points.sort(key=lambda p: (p.conversions, p.clicks, p.campaign_name), reverse=True)
     return {"days": int(days), "points": points}
 
 
 @app.get("/dashboard/sla", response_model=DashboardSlaOut)
-def dashboard_sla(ctx: dict = Depends(require_ctx), days: int = Query(default=30, ge=1, le=180)):
-    tenant_id = int(ctx.get("tenant_id") or 0)
-    if tenant_id <= 0:
-        tenant_id = 1
-    role = str(ctx.get("role") or ROLE_VIEWER)
-    require_role(role, ROLE_VIEWER)
+def dashboard_sla(ctx: ViewerCtx, days: int = Query(default=30, ge=1, le=180)):
+    tenant_id = ctx.tenant_id
 
     now = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
     start = (now - timedelta(days=days - 1)).date().isoformat()
 
     with get_db() as db:
-        rows = db.execute(
+        # Tudo agregado no SQLite (uma linha). julianday() aceita ISO com 'T'/offset/'Z';
+        # datas inválidas viram NULL e ficam fora do AVG. Tempo em segundos, arredondado a ms.
+        r = db.execute(
             """
-            SELECT status, attempts, created_at, updated_at
+            SELECT COUNT(*) AS total,
+                   COALESCE(SUM(status = 'sent'), 0) AS sent,
+                   COALESCE(SUM(status = 'failed'), 0) AS failed,
+                   COALESCE(SUM(status = 'retrying'), 0) AS retrying,
+                   COALESCE(SUM(status = 'queued'), 0) AS queued,
+                   COALESCE(SUM(status = 'sending'), 0) AS sending,
+                   COALESCE(AVG(COALESCE(attempts, 0)), 0.0) AS avg_attempts,
+                   COALESCE(AVG(CASE WHEN status IN ('sent', 'failed')
+                       THEN MAX(0.0, ROUND((julianday(updated_at) - julianday(created_at)) * 86400.0, 3)) END), 0.0) AS avg_time_sec
             FROM deliveries
             WHERE tenant_id = ? AND created_at >= ?
             """,
             (tenant_id, start),
-        ).fetchall()
-
-    total = len(rows)
-    sent = failed = retrying = queued = sending = 0
-    attempts_sum = 0
-    time_sum = 0.0
-    time_count = 0
-
-    for r in rows:
-        status = str(r["status"] or "")
-        attempts = int(r["attempts"] or 0)
-        attempts_sum += attempts
-        if status == "sent":
-            sent += 1
-        elif status == "failed":
-            failed += 1
-        elif status == "retrying":
-            retrying += 1
-        elif status == "queued":
-            queued += 1
-        elif status == "sending":
-            sending += 1
-
-        if status in ("sent", "failed"):
-            try:
-                created = datetime.fromisoformat(str(r["created_at"]).replace("Z", "+00:00"))
-                updated = datetime.fromisoformat(str(r["updated_at"]).replace("Z", "+00:00"))
-                delta = max(0.0, (updated - created).total_seconds())
-                time_sum += delta
-                time_count += 1
-            except Exception:
-                pass
+        ).fetchone()
 
-    avg_attempts = float(attempts_sum / total) if total else 0.0
-    avg_time_sec = float(time_sum / time_count) if time_count else 0.0
+    total = int(r["total"])
+    sent = int(r["sent"])
+    failed = int(r["failed"])
+    retrying = int(r["retrying"])
+    queued = int(r["queued"])
+    sending = int(r["sending"])
+    avg_attempts = float(r["avg_attempts"])
+    avg_time_sec = float(r["avg_time_sec"])
     failure_rate = float(failed / total) if total else 0.0
 
     return {
@@ -2393,70 +2300,17 @@ def run_due_deliveries(admin_key: Optional[str] = Header(default=None, alias="X-
     Em produção você rodaria isso por cron/worker.
     Para não abrir geral, protegi com X-Admin-Key (env ADMIN_KEY).
     """
-    import os
-
     required = os.getenv("ADMIN_KEY", "CHANGE_ME_ADMIN_KEY")
     if admin_key != required:
         raise HTTPException(status_code=403, detail="Forbidden")
 
-    now = datetime.now(timezone.utc)
-
-    with get_db() as db:
-        rows = db.execute(
-            """
-            SELECT id, tenant_id, channel, scheduled_at
-            FROM ads
-            WHERE status = 'scheduled' AND scheduled_at IS NOT NULL
-            """
-        ).fetchall()
-
-        sent = 0
-        for r in rows:
-            ad_id = int(r["id"])
-            tenant_id = int(r["tenant_id"])
-            channel = str(r["channel"] or "")
-            try:
-                sched = datetime.fromisoformat(str(r["scheduled_at"]).replace("Z", "+00:00"))
-            except Exception:
-                continue
-
-            if sched <= now:
-                # Quota de envio (diária)
-                try:
-                    check_daily_send_or_raise(db, tenant_id, 1)
-                except HTTPException as e:
-                    # Registra falha e mantém status scheduled (para reprocessar amanhã)
-                    db.execute(
-                        """
-                        INSERT INTO ad_deliveries (ad_id, delivered_at, result, details)
-                        VALUES (?, ?, 'fail', ?)
-                        """,
-                        (ad_id, now_iso(), f"Quota exceeded: {e.detail}"),
-                    )
-                    continue
-
-                # "Entrega" simulada: marca sent e registra delivery ok
-                db.execute(
-                    "UPDATE ads SET status = 'sent', updated_at = ? WHERE id = ?",
-                    (now_iso(), ad_id),
-                )
-                db.execute(
-                    """
-                    INSERT INTO ad_deliveries (ad_id, delivered_at, result, details)
-                    VALUES (?, ?, 'ok', ?)
-                    """,
-                    (ad_id, now_iso(), "Simulated delivery"),
-                )
-                increment_daily_send(db, tenant_id, channel, 1)
-                sent += 1
-
-    return {"sent": sent, "ts": now_iso()}
+    ts = now_iso()
+    sent = run_due_once("Simulated delivery", ts=ts)
+    return {"sent": sent, "ts": ts}
 
 
 @app.post("/jobs/process-deliveries")
 def job_process_deliveries(admin_key: Optional[str] = Header(default=None, alias="X-Admin-Key")):
-    import os
-
     required = os.getenv("ADMIN_KEY", "CHANGE_ME_ADMIN_KEY")
     if admin_key != required:
         raise HTTPException(status_code=403, detail="Forbidden")
@@ -1,3 +1,40 @@
+import os
+from typing import Optional
+
+from batch_writer import BatchWriter
+from db import now_iso
+
+
+# Eventos de métrica (click/impression/conversion) saem do caminho do request:
+# fila limitada (drop-oldest) + flush em lote a cada ~100ms ou 500 eventos.
+_events_writer = BatchWriter(
+    "metric_events",
+    """
+    INSERT INTO metric_events (tenant_id, ad_id, link_id, event_type, value, meta_json, created_at)
+    VALUES (?, ?, ?, ?, ?, NULL, ?)
+    """,
+    batch_max=500,
+    flush_interval=0.1,
+    maxsize=int(os.getenv("METRIC_EVENTS_QUEUE_MAX", "10000")),
+)
+
+
+def record_metric_event(tenant_id: int, ad_id: Optional[int], link_id: Optional[int], event_type: str, value: int = 1) -> None:
+    _events_writer.put((tenant_id, ad_id, link_id, event_type, value, now_iso()))
+
+
+def start_metric_writer() -> None:
+    _events_writer.start()
+
+
+def stop_metric_writer() -> None:
+    _events_writer.stop()
+
+
+def flush_metric_events() -> int:
+    return _events_writer.flush()
+
+
 def ctr(clicks: int, impressions: int) -> float:
     if impressions <= 0:
         return 0.0
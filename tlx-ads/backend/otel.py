@@ -1,11 +1,16 @@
+import logging
 import os
-import importlib
+
+
+logger = logging.getLogger(__name__)
 
 
 def setup_otel(app) -> None:
-    """Instrumenta FastAPI/requests e exporta spans via OTLP/HTTP.
+    """Instrumenta FastAPI (e opcionalmente requests) e exporta spans via OTLP/HTTP.
 
-    Ativa somente se OTEL_EXPORTER_OTLP_ENDPOINT estiver definido.
+    Ativa somente se OTEL_EXPORTER_OTLP_ENDPOINT estiver definido. Ajustes:
+    OTEL_SAMPLE_RATIO (amostragem por trace, padrão 1.0), OTEL_BSP_MAX_QUEUE,
+    OTEL_BSP_MAX_BATCH, OTEL_BSP_DELAY_MS e OTEL_INSTRUMENT_REQUESTS=1.
     """
 
     endpoint = (os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT") or "").strip()
@@ -14,24 +19,39 @@ def setup_otel(app) -> None:
 
     service_name = os.getenv("OTEL_SERVICE_NAME", "tlxauto-ads")
 
-    # Imports atrasados para manter o custo zero quando OTel estiver desativado
-    trace = importlib.import_module("opentelemetry.trace")
-    Resource = getattr(importlib.import_module("opentelemetry.sdk.resources"), "Resource")
-    TracerProvider = getattr(importlib.import_module("opentelemetry.sdk.trace"), "TracerProvider")
-    BatchSpanProcessor = getattr(importlib.import_module("opentelemetry.sdk.trace.export"), "BatchSpanProcessor")
-    OTLPSpanExporter = getattr(
-        importlib.import_module("opentelemetry.exporter.otlp.proto.http.trace_exporter"),
-        "OTLPSpanExporter",
-    )
-    FastAPIInstrumentor = getattr(importlib.import_module("opentelemetry.instrumentation.fastapi"), "FastAPIInstrumentor")
-    RequestsInstrumentor = getattr(importlib.import_module("opentelemetry.instrumentation.requests"), "RequestsInstrumentor")
+    # Imports só aqui (custo zero quando OTel está desativado), mas diretos: sem importlib/getattr.
+    # Pacote ausente com endpoint configurado não derruba o boot; só segue sem tracing.
+    try:
+        from opentelemetry import trace
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.sdk.trace.sampling import ParentBasedTraceIdRatio
+    except ImportError:
+        logger.warning("OTEL_EXPORTER_OTLP_ENDPOINT definido, mas pacotes opentelemetry não instalados")
+        return
 
     resource = Resource.create({"service.name": service_name})
-    provider = TracerProvider(resource=resource)
+    sampler = ParentBasedTraceIdRatio(float(os.getenv("OTEL_SAMPLE_RATIO", "1.0")))
+    provider = TracerProvider(resource=resource, sampler=sampler)
     trace.set_tracer_provider(provider)
 
     exporter = OTLPSpanExporter(endpoint=endpoint)
-    provider.add_span_processor(BatchSpanProcessor(exporter))
+    provider.add_span_processor(
+        BatchSpanProcessor(
+            exporter,
+            max_queue_size=int(os.getenv("OTEL_BSP_MAX_QUEUE", "2048")),
+            max_export_batch_size=int(os.getenv("OTEL_BSP_MAX_BATCH", "512")),
+            schedule_delay_millis=int(os.getenv("OTEL_BSP_DELAY_MS", "10000")),
+        )
+    )
 
     FastAPIInstrumentor.instrument_app(app)
-    RequestsInstrumentor().instrument()
+
+    # requests instrumentado só sob demanda: embrulha toda chamada HTTP de saída.
+    if os.getenv("OTEL_INSTRUMENT_REQUESTS") == "1":
+        from opentelemetry.instrumentation.requests import RequestsInstrumentor
+
+        RequestsInstrumentor().instrument()
@@ -5,13 +5,17 @@ from fastapi import HTTPException
 class SimpleRateLimiter:
     def __init__(self, limit_per_min: int):
         self.limit = limit_per_min
-        self.buckets: dict[str, int] = {}  # key:window -> count
+        self.buckets: dict[str, int] = {}  # key -> hits na janela atual
+        self._window = 0
 
     def hit(self, key: str) -> None:
-        now = time.time()
-        window = int(now // 60)
-        wk = f"{key}:{window}"
-        count = self.buckets.get(wk, 0) + 1
-        self.buckets[wk] = count
+        window = int(time.monotonic() // 60)
+        if window != self._window:
+            # virou a janela: todas as contagens são da anterior, zera tudo (memória limitada)
+            self._window = window
+            self.buckets.clear()
+
+        count = self.buckets.get(key, 0) + 1
+        self.buckets[key] = count
         if count > self.limit:
             raise HTTPException(status_code=429, detail="Rate limit exceeded")
@@ -1,39 +1,72 @@
+import hashlib
 import os
+import struct
 import time
 import importlib
+from functools import lru_cache
+from typing import Any
 
 from fastapi import HTTPException
 
 from rate_limit import SimpleRateLimiter
 
 
+# INCR + EXPIRE (folga de 2 minutos) atômicos e num único round trip (EVALSHA).
+_HIT_SCRIPT = """
+local v = redis.call('INCR', KEYS[1])
+if v == 1 then
+  redis.call('EXPIRE', KEYS[1], 120)
+end
+return v
+"""
+
+
+# Um cliente (e pool de conexões) por REDIS_URL no processo, compartilhado entre limiters.
+_CLIENTS: dict[str, Any] = {}
+
+
+def _redis_client(redis_url: str):
+    client = _CLIENTS.get(redis_url)
+    if client is None:
+        mod = importlib.import_module("redis")
+        Redis = getattr(mod, "Redis")
+        client = Redis.from_url(
+            redis_url,
+            max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", "64")),
+            socket_keepalive=True,
+            health_check_interval=30,
+        )
+        client = _CLIENTS.setdefault(redis_url, client)
+    return client
+
+
 class RedisRateLimiter:
     def __init__(self, redis_url: str, limit_per_min: int, prefix: str = "rl"):
         self.redis_url = redis_url
         self.limit = limit_per_min
         self.prefix = prefix
+        self._prefix_b = f"{prefix}:".encode()
         self._redis = None
+        self._hit_script = None
 
     def _get_client(self):
         if self._redis is None:
-            mod = importlib.import_module("redis")
-            Redis = getattr(mod, "Redis")
-            self._redis = Redis.from_url(self.redis_url)
+            self._redis = _redis_client(self.redis_url)
+            self._hit_script = self._redis.register_script(_HIT_SCRIPT)
         return self._redis
 
     def hit(self, key: str) -> None:
         bucket = int(time.time() // 60)
-        k = f"{self.prefix}:{key}:{bucket}"
+        # chave binária de tamanho fixo: prefixo legível + blake2b-64 do key + janela (uint32)
+        k = self._prefix_b + hashlib.blake2b(key.encode(), digest_size=8).digest() + struct.pack(">I", bucket)
 
-        r = self._get_client()
-        val = int(r.incr(k, 1))
-        if val == 1:
-            # folga de 2 minutos
-            r.expire(k, 120)
+        self._get_client()
+        val = int(self._hit_script(keys=[k]))
         if val > self.limit:
             raise HTTPException(status_code=429, detail="Rate limit exceeded")
 
 
+@lru_cache(maxsize=None)
 def get_rate_limiter(limit_per_min: int, prefix: str = "rl"):
     """Retorna rate limiter Redis se REDIS_URL estiver setado, senão fallback in-memory."""
 
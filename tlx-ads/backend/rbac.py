@@ -1,3 +1,5 @@
+from typing import Callable
+
 from fastapi import HTTPException
 
 ROLE_ADMIN = "admin"
@@ -14,3 +16,15 @@ ROLE_ORDER = {
 def require_role(current_role: str, minimum: str) -> None:
     if ROLE_ORDER.get(current_role, 0) < ROLE_ORDER.get(minimum, 0):
         raise HTTPException(status_code=403, detail="Insufficient permissions")
+
+
+def role_checker(minimum: str) -> Callable[[str], None]:
+    """Versão de require_role com o rank mínimo resolvido uma vez (na definição da dependência)."""
+    min_rank = ROLE_ORDER.get(minimum, 0)
+    rank = ROLE_ORDER.get
+
+    def check(current_role: str) -> None:
+        if rank(current_role, 0) < min_rank:
+            raise HTTPException(status_code=403, detail="Insufficient permissions")
+
+    return check
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import time
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from typing import Any, Optional
@@ -56,20 +57,93 @@ LIMITS_BY_PLAN: dict[str, PlanLimits] = {
 }
 
 
+# plano -> campo de uso -> limite (None = ilimitado), achatado no import para o caminho de quota.
+_LIMIT_TABLE: dict[str, dict[str, Optional[int]]] = {
+    p: {
+        "ads_created": l.ads_created_monthly,
+        "templates_created": l.templates_created_monthly,
+        "links_created": l.links_created_monthly,
+        "invites_created": l.invites_created_monthly,
+        "sends_daily_total": l.sends_daily_total,
+    }
+    for p, l in LIMITS_BY_PLAN.items()
+}
+
+# Campos de uso mensal (e SELECTs já montados por campo). O incremento fica nos triggers
+# trg_usage_* (db.py), disparados pelo próprio INSERT do recurso.
+_MONTHLY_FIELDS = ("ads_created", "templates_created", "links_created", "invites_created")
+_MONTHLY_SELECT_SQL: dict[str, str] = {
+    f: f"SELECT {f} as v FROM tenant_usage_monthly WHERE tenant_id = ? AND month = ?" for f in _MONTHLY_FIELDS
+}
+
+# Canal -> coluna específica de envios diários; canal desconhecido só soma no total.
+_CHANNEL_COL: dict[str, str] = {
+    "whatsapp": "sends_whatsapp",
+    "x": "sends_x",
+    "twitter": "sends_x",
+    "email": "sends_email",
+}
+_DAILY_SEND_SQL: dict[str, str] = {
+    col: f"""
+        INSERT INTO tenant_usage_daily (tenant_id, day, sends_total, {col}, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(tenant_id, day) DO UPDATE
+        SET sends_total = sends_total + excluded.sends_total,
+            {col} = {col} + excluded.{col},
+            updated_at = excluded.updated_at
+        """
+    for col in set(_CHANNEL_COL.values())
+}
+_DAILY_SEND_TOTAL_SQL = """
+    INSERT INTO tenant_usage_daily (tenant_id, day, sends_total, created_at, updated_at)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(tenant_id, day) DO UPDATE
+    SET sends_total = sends_total + excluded.sends_total,
+        updated_at = excluded.updated_at
+    """
+
+
+# Chaves de dia/mês memoizadas pelo número do dia UTC (time.time()//86400): só o
+# primeiro chamador de cada dia formata a data.
+_DAY_CACHE: tuple[int, str] = (-1, "")
+_MONTH_CACHE: tuple[int, str] = (-1, "")
+
+
 def _utc_day_key(dt: Optional[datetime] = None) -> str:
-    d = dt or datetime.now(timezone.utc)
-    return d.date().isoformat()
+    global _DAY_CACHE
+    if dt is not None:
+        return dt.date().isoformat()
+    d = int(time.time()) // 86400
+    cached = _DAY_CACHE
+    if cached[0] == d:
+        return cached[1]
+    key = datetime.fromtimestamp(d * 86400, timezone.utc).date().isoformat()
+    _DAY_CACHE = (d, key)
+    return key
 
 
 def _utc_month_key(dt: Optional[datetime] = None) -> str:
-    d = dt or datetime.now(timezone.utc)
-    return f"{d.year:04d}-{d.month:02d}"
+    global _MONTH_CACHE
+    if dt is not None:
+        return f"{dt.year:04d}-{dt.month:02d}"
+    d = int(time.time()) // 86400
+    cached = _MONTH_CACHE
+    if cached[0] == d:
+        return cached[1]
+    day = datetime.fromtimestamp(d * 86400, timezone.utc)
+    key = f"{day.year:04d}-{day.month:02d}"
+    _MONTH_CACHE = (d, key)
+    return key
 
 
 def _get_limits(plan: str) -> PlanLimits:
     return LIMITS_BY_PLAN.get(str(plan or PLAN_FREE), LIMITS_BY_PLAN[PLAN_FREE])
 
 
+def _limits_for(plan: str) -> dict[str, Optional[int]]:
+    return _LIMIT_TABLE.get(plan) or _LIMIT_TABLE[PLAN_FREE]
+
+
 def ensure_plan_row(db, tenant_id: int) -> None:
     """Garante que existe um row em tenant_plans (fallback para free/active)."""
     ts = now_iso()
@@ -83,7 +157,7 @@ def ensure_plan_row(db, tenant_id: int) -> None:
 
 
 def get_plan(db, tenant_id: int) -> tuple[str, str]:
-    ensure_plan_row(db, tenant_id)
+    # Só leitura: tenant sem linha em tenant_plans é free/active (a linha nasce no set_plan).
     row = db.execute(
         "SELECT plan, status FROM tenant_plans WHERE tenant_id = ?",
         (int(tenant_id),),
@@ -96,7 +170,6 @@ def get_plan(db, tenant_id: int) -> tuple[str, str]:
 
 
 def get_stripe_refs(db, tenant_id: int) -> tuple[Optional[str], Optional[str]]:
-    ensure_plan_row(db, tenant_id)
     row = db.execute(
         "SELECT stripe_customer_id, stripe_subscription_id FROM tenant_plans WHERE tenant_id = ?",
         (int(tenant_id),),
@@ -140,34 +213,6 @@ def set_plan(
     )
 
 
-def _ensure_usage_month_row(db, tenant_id: int, month: str) -> None:
-    ts = now_iso()
-    db.execute(
-        """
-        INSERT OR IGNORE INTO tenant_usage_monthly (
-          tenant_id, month,
-          ads_created, templates_created, links_created, invites_created,
-          created_at, updated_at
-        ) VALUES (?, ?, 0, 0, 0, 0, ?, ?)
-        """,
-        (int(tenant_id), month, ts, ts),
-    )
-
-
-def _ensure_usage_day_row(db, tenant_id: int, day: str) -> None:
-    ts = now_iso()
-    db.execute(
-        """
-        INSERT OR IGNORE INTO tenant_usage_daily (
-          tenant_id, day,
-          sends_total, sends_whatsapp, sends_x, sends_email,
-          created_at, updated_at
-        ) VALUES (?, ?, 0, 0, 0, 0, ?, ?)
-        """,
-        (int(tenant_id), day, ts, ts),
-    )
-
-
 def _quota_exceeded(detail: str) -> None:
     # 402: Payment Required (bom para quotas/planos)
     raise HTTPException(status_code=402, detail=detail)
@@ -178,95 +223,77 @@ def check_monthly_resource_or_raise(db, tenant_id: int, field: str, amount: int
     if status in ("canceled",):
         _quota_exceeded("Plano inativo. Atualize sua assinatura para continuar.")
 
-    limits = _get_limits(plan)
     month = _utc_month_key()
-    _ensure_usage_month_row(db, tenant_id, month)
-
-    if field == "ads_created":
-        limit = limits.ads_created_monthly
-    elif field == "templates_created":
-        limit = limits.templates_created_monthly
-    elif field == "links_created":
-        limit = limits.links_created_monthly
-    elif field == "invites_created":
-        limit = limits.invites_created_monthly
-    else:
+
+    if field not in _MONTHLY_SELECT_SQL:
         raise HTTPException(status_code=500, detail=f"Unknown usage field: {field}")
 
+    limit = _limits_for(plan)[field]
     if limit is None:
         return
 
-    row = db.execute(
-        f"SELECT {field} as v FROM tenant_usage_monthly WHERE tenant_id = ? AND month = ?",
-        (int(tenant_id), month),
-    ).fetchone()
+    row = db.execute(_MONTHLY_SELECT_SQL[field], (int(tenant_id), month)).fetchone()
     current = int(row["v"] or 0) if row else 0
 
     if current + int(amount) > int(limit):
         _quota_exceeded(f"Limite do plano atingido para {field} (mês {month}).")
 
 
-def increment_monthly_resource(db, tenant_id: int, field: str, amount: int = 1) -> None:
-    month = _utc_month_key()
-    _ensure_usage_month_row(db, tenant_id, month)
-    ts = now_iso()
-    db.execute(
-        f"UPDATE tenant_usage_monthly SET {field} = {field} + ?, updated_at = ? WHERE tenant_id = ? AND month = ?",
-        (int(amount), ts, int(tenant_id), month),
-    )
-
-
 def check_daily_send_or_raise(db, tenant_id: int, amount: int = 1) -> None:
     plan, status = get_plan(db, tenant_id)
     if status in ("canceled",):
         _quota_exceeded("Plano inativo. Atualize sua assinatura para continuar.")
 
-    limits = _get_limits(plan)
-    if limits.sends_daily_total is None:
+    limit = _limits_for(plan)["sends_daily_total"]
+    if limit is None:
         return
 
     day = _utc_day_key()
-    _ensure_usage_day_row(db, tenant_id, day)
-
     row = db.execute(
         "SELECT sends_total FROM tenant_usage_daily WHERE tenant_id = ? AND day = ?",
         (int(tenant_id), day),
     ).fetchone()
     current = int(row[0] or 0) if row else 0
 
-    if current + int(amount) > int(limits.sends_daily_total):
+    if current + int(amount) > int(limit):
         _quota_exceeded(f"Limite diário de envios atingido (dia {day}).")
 
 
+def daily_send_remaining(db, tenant_id: int) -> Optional[int]:
+    # Envios ainda disponíveis hoje (None = sem limite; 0 = plano inativo ou cota esgotada).
+    plan, status = get_plan(db, tenant_id)
+    if status in ("canceled",):
+        return 0
+
+    limit = _limits_for(plan)["sends_daily_total"]
+    if limit is None:
+        return None
+
+    day = _utc_day_key()
+    row = db.execute(
+        "SELECT sends_total FROM tenant_usage_daily WHERE tenant_id = ? AND day = ?",
+        (int(tenant_id), day),
+    ).fetchone()
+    current = int(row[0] or 0) if row else 0
+    return max(0, int(limit) - current)
+
+
 def increment_daily_send(db, tenant_id: int, channel: str, amount: int = 1) -> None:
     day = _utc_day_key()
-    _ensure_usage_day_row(db, tenant_id, day)
     ts = now_iso()
 
-    channel_key = "sends_total"
-    ch = str(channel or "").strip().lower()
-    if ch == "whatsapp":
-        channel_key = "sends_whatsapp"
-    elif ch in ("x", "twitter"):
-        channel_key = "sends_x"
-    elif ch == "email":
-        channel_key = "sends_email"
+    # canais já chegam normalizados; normaliza só se o lookup direto falhar
+    col = _CHANNEL_COL.get(channel) or _CHANNEL_COL.get(str(channel or "").strip().lower())
+    if col is None:
+        db.execute(_DAILY_SEND_TOTAL_SQL, (int(tenant_id), day, int(amount), ts, ts))
+        return
 
     # total + específico
-    db.execute(
-        """
-        UPDATE tenant_usage_daily
-        SET sends_total = sends_total + ?,
-            {channel_key} = {channel_key} + ?,
-            updated_at = ?
-        WHERE tenant_id = ? AND day = ?
-        """.format(channel_key=channel_key),
-        (int(amount), int(amount), ts, int(tenant_id), day),
-    )
+    db.execute(_DAILY_SEND_SQL[col], (int(tenant_id), day, int(amount), int(amount), ts, ts))
 
 
 def plan_snapshot(db, tenant_id: int) -> dict[str, Any]:
-    ensure_plan_row(db, tenant_id)
+    # Só leitura: linhas de plano/uso ausentes contam como free/active e uso zero.
     row = db.execute(
         "SELECT plan, status, trial_ends_at, current_period_end FROM tenant_plans WHERE tenant_id = ?",
         (int(tenant_id),),
@@ -279,8 +306,6 @@ def plan_snapshot(db, tenant_id: int) -> dict[str, Any]:
 
     month = _utc_month_key()
     day = _utc_day_key()
-    _ensure_usage_month_row(db, tenant_id, month)
-    _ensure_usage_day_row(db, tenant_id, day)
 
     m = db.execute(
         """
@@ -3,6 +3,14 @@ import string
 
 ALPH = string.ascii_letters + string.digits
 
+# Maior múltiplo de len(ALPH) que cabe em um byte: bytes acima disso são descartados
+# para o módulo não enviesar o alfabeto.
+_BYTE_LIMIT = 256 - 256 % len(ALPH)
+
 
 def generate_slug(length: int = 7) -> str:
-    return "".join(secrets.choice(ALPH) for _ in range(length))
+    # Um único buffer de aleatoriedade por slug (em vez de um secrets.choice por caractere).
+    out: list[str] = []
+    while len(out) < length:
+        out.extend(ALPH[b % len(ALPH)] for b in secrets.token_bytes(length * 2) if b < _BYTE_LIMIT)
+    return "".join(out[:length])
@@ -1,6 +1,7 @@
 """Smoke test rápido do TLX-ADS (sem subir servidor).
 
-Roda a API in-process via TestClient e valida os fluxos principais:
+Roda a API in-process (httpx.AsyncClient + ASGITransport, chamadas independentes
+em paralelo) e valida os fluxos principais:
 - register/login (token)
 - /auth/me
 - CRUD básico de ads + schedule
@@ -8,150 +9,368 @@ Roda a API in-process via TestClient e valida os fluxos principais:
 - filtros em /ads
 - job protegido /jobs/run-due
 - listagem de deliveries
+- meta/payload JSON com int acima de 64 bits
+- segment-send com falha em um lote depois de outros já gravados
+- auditoria regravada quando o banco falha uma vez
+- split de placeholders igual entre re2 (se instalado) e re
+- tokens iguais entre pybase64 (se instalado) e base64 do stdlib
 
-Uso:
-  TLX_ADS_DB_PATH=/tmp/tlx_ads_test.sqlite3 \
+Uso (sem TLX_ADS_DB_PATH o banco é SQLite em memória; TLX_ADS_TEST_FAST=1 desliga o
+fsync quando o banco é arquivo):
+  TLX_ADS_DB_PATH=/tmp/tlx_ads_test.sqlite3 TLX_ADS_TEST_FAST=1 \
   JWT_SECRET=dev-test PWD_SALT=pepper ADMIN_KEY=adm \
   python smoke_test.py
 """
 
 from __future__ import annotations
 
+import asyncio
+import functools
+import json
 import os
-import tempfile
+import sqlite3
 
-# IMPORTANTE: setar DB path antes de importar a app (db.py lê env no import)
-if not os.getenv("TLX_ADS_DB_PATH"):
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".sqlite3")
-    os.environ["TLX_ADS_DB_PATH"] = tmp.name
+import httpx
+import orjson
 
-os.environ.setdefault("JWT_SECRET", "dev-test")
-os.environ.setdefault("PWD_SALT", "pepper")
-os.environ.setdefault("ADMIN_KEY", "adm")
 
-from fastapi.testclient import TestClient  # noqa: E402
+@functools.cache
+def build_app():
+    # IMPORTANTE: setar env antes de importar a app (db.py lê env no import); memoizado para
+    # que vários testes no mesmo processo reaproveitem a mesma instância ASGI.
+    # Padrão: banco em memória compartilhado entre as conexões do processo (sem I/O de disco).
+    os.environ.setdefault("TLX_ADS_DB_PATH", "file::memory:?cache=shared")
+    if os.getenv("TLX_ADS_TEST_FAST") == "1":
+        # banco em arquivo descartável: troca durabilidade por velocidade (db.py aplica nas conexões)
+        os.environ.setdefault("TLX_ADS_SQLITE_SYNCHRONOUS", "OFF")
+        os.environ.setdefault("TLX_ADS_SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))
 
-from main import app  # noqa: E402
+    os.environ.setdefault("JWT_SECRET", "dev-test")
+    os.environ.setdefault("PWD_SALT", "pepper")
+    os.environ.setdefault("ADMIN_KEY", "adm")
 
+    from main import app
 
-def main() -> None:
-    with TestClient(app) as c:
-        r = c.get("/health")
-        assert r.status_code == 200 and r.json().get("ok") is True
+    return app
+
+
+def make_client(app) -> httpx.AsyncClient:
+    # corpos serializados com orjson (content=...); o content-type vai como header padrão do client
+    return httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://t", headers={"content-type": "application/json"}
+    )
+
+
+async def check_segment_send_partial_failure(c: httpx.AsyncClient, auth: dict, tenant_id: int) -> None:
+    # Segment-send grava em lotes com commit próprio: um lote que falha depois de outros já
+    # gravados não pode sumir com a contagem nem com a auditoria.
+    from audit import flush_audit
+    from db import get_db
+
+    r = await c.post("/segments", content=orjson.dumps({"name": "parcial"}), headers=auth)
+    assert r.status_code == 200, r.text
+    seg_id = r.json()["id"]
+    emails = ["ok1@seg.test", "ok2@seg.test", "fail@seg.test"]
+    for email in emails:
+        r = await c.post("/contacts", content=orjson.dumps({"name": email, "email": email}), headers=auth)
+        assert r.status_code == 200, r.text
+        r = await c.post(
+            f"/segments/{seg_id}/members", content=orjson.dumps({"contact_id": r.json()["id"]}), headers=auth
+        )
+        assert r.status_code == 200, r.text
+
+    # lote de 1 linha + trigger que aborta o INSERT de um destinatário (simula falha no meio)
+    with get_db() as db:
+        db.execute(
+            """
+            CREATE TRIGGER smoke_fail_delivery BEFORE INSERT ON deliveries
+            WHEN NEW.to_addr = 'fail@seg.test'
+            BEGIN SELECT RAISE(ABORT, 'forced failure'); END
+            """
+        )
+    os.environ["AUTOMATION_INSERT_CHUNK"] = "1"
+    try:
+        r = await c.post(
+            "/automation/segment-send",
+            content=orjson.dumps({"segment_id": seg_id, "channel": "email", "body": "oi"}),
+            headers=auth,
+        )
+    finally:
+        os.environ.pop("AUTOMATION_INSERT_CHUNK", None)
+        with get_db() as db:
+            db.execute("DROP TRIGGER smoke_fail_delivery")
+
+    assert r.status_code == 200, r.text
+    out = r.json()
+    assert out["failed"] >= 1 and out["queued"] + out["failed"] == len(emails), out
+
+    flush_audit()
+    with get_db() as db:
+        stored = db.execute(
+            "SELECT COUNT(*) FROM deliveries WHERE tenant_id = ? AND to_addr LIKE '%@seg.test'", (tenant_id,)
+        ).fetchone()[0]
+        audit = db.execute(
+            """
+            SELECT meta_json FROM audit_logs
+            WHERE tenant_id = ? AND action = 'automation.segment_send' AND entity_id = ?
+            """,
+            (tenant_id, str(seg_id)),
+        ).fetchone()
+    assert stored == out["queued"], (stored, out)
+    assert audit is not None and json.loads(audit["meta_json"])["queued"] == out["queued"], audit
+
+
+def check_template_regex_backends() -> None:
+    # _render_parts espera o nome da variável nos índices ímpares do split; confere o backend
+    # ativo (re2 ou re) e, com google-re2 instalado, o próprio re2 contra o stdlib.
+    import re
+
+    import templates_util
+
+    bodies = ["Oi {{nome}}!", "{{a}}{{b}}", "sem placeholder", "{{x}} e {{ y }} e {{z_1}}", "é {{nome}} é"]
+    variables = {"nome": "Ana", "a": "1", "b": "2", "x": "X", "z_1": "Z"}
+    reference = re.compile(templates_util._VAR_RE, re.ASCII)
+    patterns = [templates_util.VAR_PATTERN]
+    try:
+        import re2
+    except ImportError:
+        pass
+    else:
+        patterns.append(re2.compile(templates_util._VAR_RE))
+
+    for pattern in patterns:
+        for text in bodies:
+            parts = tuple(pattern.split(text))
+            assert parts == tuple(reference.split(text)), (pattern, text, parts)
+            assert templates_util._render_parts(parts, variables) == templates_util._render_parts(
+                tuple(reference.split(text)), variables
+            )
+    assert templates_util.render_template("Oi {{nome}}!", variables) == "Oi Ana!"
+
+
+def check_token_encoders() -> None:
+    # Tokens precisam sair idênticos com pybase64 (se instalado) e com o base64 do stdlib:
+    # URL-safe e sem padding.
+    import base64
+    import string
+
+    import token_utils
+
+    encoders = [token_utils.urlsafe_b64encode]
+    try:
+        from pybase64 import urlsafe_b64encode as pybase64_encode
+    except ImportError:
+        pass
+    else:
+        encoders.append(pybase64_encode)
+
+    for n in range(0, 65):
+        raw = os.urandom(n)
+        expected = base64.urlsafe_b64encode(raw).rstrip(b"=")
+        for encode in encoders:
+            assert encode(raw).rstrip(b"=") == expected, (encode, n)
+
+    allowed = set(string.ascii_letters + string.digits + "-_")
+    tokens = [token_utils.secure_token(16), *token_utils.secure_tokens(5, 16)]
+    assert len(tokens) == 6 and len(set(tokens)) == 6
+    for tok in tokens:
+        assert len(tok) == 22 and set(tok) <= allowed, tok
+
+
+def check_audit_write_retry(tenant_id: int) -> None:
+    # Falha do banco na gravação da auditoria (ex.: lock) não pode descartar o lote.
+    import batch_writer
+    from audit import flush_audit, write_audit
+    from db import get_db
 
+    real_get_db = batch_writer.get_db
+    calls = {"n": 0}
+
+    def flaky_get_db():
+        calls["n"] += 1
+        if calls["n"] == 1:
+            raise sqlite3.OperationalError("database is locked")
+        return real_get_db()
+
+    batch_writer.get_db = flaky_get_db
+    try:
+        write_audit(tenant_id, None, "smoke.retry", "smoke", "1", {})
+        flush_audit()
+    finally:
+        batch_writer.get_db = real_get_db
+
+    assert calls["n"] >= 2, calls
+    with get_db() as db:
+        n = db.execute(
+            "SELECT COUNT(*) FROM audit_logs WHERE tenant_id = ? AND action = 'smoke.retry'", (tenant_id,)
+        ).fetchone()[0]
+    assert n == 1, n
+
+
+async def main_async() -> None:
+    app = build_app()
+    from audit import flush_audit
+    from db import get_db
+    from metrics_util import flush_metric_events
+
+    # ASGITransport não dispara startup/shutdown: roda o lifespan da app explicitamente
+    client = make_client(app)
+    async with app.router.lifespan_context(app), client as c:
         email = "user_test@tlxads.local"
         pw = "senha123"
 
-        r = c.post("/auth/register", json={"email": email, "password": pw})
+        r_health, r = await asyncio.gather(
+            c.get("/health"),
+            c.post("/auth/register", content=orjson.dumps({"email": email, "password": pw})),
+        )
+        assert r_health.status_code == 200 and r_health.json().get("ok") is True
+
         assert r.status_code == 200, r.text
         body = r.json()
         tok = body["access_token"]
         assert int(body.get("tenant_id") or 0) > 0
         assert str(body.get("role") or "")
+        auth = {"Authorization": f"Bearer {tok}"}
 
-        r = c.get("/auth/me", headers={"Authorization": f"Bearer {tok}"})
-        assert r.status_code == 200 and r.json()["email"] == email
-
-        r = c.post(
-            "/ads",
-            json={
-                "title": "Meu anúncio",
-                "body": "Texto",
-                "channel": "whatsapp",
-                "target_url": None,
-            },
-            headers={"Authorization": f"Bearer {tok}"},
+        r_me, r_ad, r_tpl = await asyncio.gather(
+            c.get("/auth/me", headers=auth),
+            c.post(
+                "/ads",
+                content=orjson.dumps({
+                    "title": "Meu anúncio",
+                    "body": "Texto",
+                    "channel": "whatsapp",
+                    "target_url": None,
+                }),
+                headers=auth,
+            ),
+            # templates + render
+            c.post(
+                "/templates",
+                content=orjson.dumps({"name": "promo", "body": "Oi {{nome}}, confira!"}),
+                headers=auth,
+            ),
         )
-        assert r.status_code == 200
-        ad_id = r.json()["id"]
+        assert r_me.status_code == 200 and r_me.json()["email"] == email
+        assert r_ad.status_code == 200
+        ad_id = r_ad.json()["id"]
+        assert r_tpl.status_code == 200, r_tpl.text
+        tpl_id = r_tpl.json()["id"]
 
-        # templates + render
-        r = c.post(
-            "/templates",
-            json={"name": "promo", "body": "Oi {{nome}}, confira!"},
-            headers={"Authorization": f"Bearer {tok}"},
-        )
-        assert r.status_code == 200, r.text
-        tpl_id = r.json()["id"]
-
-        r = c.post(
-            "/ads",
-            json={
-                "title": "Meu anúncio 2",
-                "body": "placeholder",
-                "channel": "whatsapp",
-                "template_id": tpl_id,
-                "variables": {"nome": "Ana"},
-            },
-            headers={"Authorization": f"Bearer {tok}"},
+        r_ad2, r = await asyncio.gather(
+            c.post(
+                "/ads",
+                content=orjson.dumps({
+                    "title": "Meu anúncio 2",
+                    "body": "placeholder",
+                    "channel": "whatsapp",
+                    "template_id": tpl_id,
+                    "variables": {"nome": "Ana"},
+                }),
+                headers=auth,
+            ),
+            c.post(
+                f"/ads/{ad_id}/schedule",
+                params={"scheduled_at": "2026-01-11T15:00:00+00:00"},
+                headers=auth,
+            ),
         )
-        assert r.status_code == 200, r.text
-        assert "rendered_body" in r.json()
+        assert r_ad2.status_code == 200, r_ad2.text
+        assert "rendered_body" in r_ad2.json()
+        assert r.status_code == 200 and r.json()["status"] == "scheduled"
 
-        r = c.post(
-            f"/ads/{ad_id}/schedule",
-            params={"scheduled_at": "2026-01-11T15:00:00+00:00"},
-            headers={"Authorization": f"Bearer {tok}"},
+        # JSON livre com int acima de 64 bits (orjson recusa; json do stdlib aceita): não pode dar 500.
+        # O corpo vai com json.dumps porque o próprio orjson não serializa esse valor.
+        big = 2**70
+        r_contact, r_deliv = await asyncio.gather(
+            c.post("/contacts", content=json.dumps({"name": "big", "email": "big@x.y", "meta": {"n": big}}), headers=auth),
+            c.post(
+                "/deliveries",
+                content=json.dumps({"channel": "email", "to_addr": "big@x.y", "payload": {"n": big}}),
+                headers=auth,
+            ),
         )
-        assert r.status_code == 200 and r.json()["status"] == "scheduled"
+        assert r_contact.status_code == 200, r_contact.text
+        assert json.loads(r_contact.json()["meta_json"]) == {"n": big}
+        assert r_deliv.status_code == 200, r_deliv.text
+
+        await check_segment_send_partial_failure(c, auth, int(body["tenant_id"]))
 
         # bug importante: limpar scheduled_at com null via PATCH
-        r = c.patch(
+        r = await c.patch(
             f"/ads/{ad_id}",
-            json={"status": "draft", "scheduled_at": None},
-            headers={"Authorization": f"Bearer {tok}"},
+            content=orjson.dumps({"status": "draft", "scheduled_at": None}),
+            headers=auth,
         )
         assert r.status_code == 200 and r.json()["scheduled_at"] is None
 
-        r = c.get(
-            "/ads",
-            params={"status": "draft", "q": "Meu", "limit": 10, "offset": 0},
-            headers={"Authorization": f"Bearer {tok}"},
-        )
-        assert r.status_code == 200 and len(r.json()) >= 1
-
-        r = c.post("/jobs/run-due", headers={"X-Admin-Key": "wrong"})
-        assert r.status_code == 403
-
-        r = c.post("/jobs/run-due", headers={"X-Admin-Key": os.getenv("ADMIN_KEY", "")})
-        assert r.status_code == 200
-
-        r = c.get(
-            f"/ads/{ad_id}/deliveries",
-            headers={"Authorization": f"Bearer {tok}"},
-        )
-        assert r.status_code == 200 and isinstance(r.json(), list)
-
-        # short link + redirect + métricas
-        r = c.post(
-            "/links",
-            json={
-                "destination_url": "https://example.com/landing",
-                "ad_id": ad_id,
-                "utm_source": "tlxauto",
-                "utm_medium": "whatsapp",
-                "utm_campaign": "teste",
-            },
-            headers={"Authorization": f"Bearer {tok}"},
+        r_list, r_forbidden, r_due, r_deliv, r = await asyncio.gather(
+            c.get(
+                "/ads",
+                params={"status": "draft", "q": "Meu", "limit": 10, "offset": 0},
+                headers=auth,
+            ),
+            c.post("/jobs/run-due", headers={"X-Admin-Key": "wrong"}),
+            c.post("/jobs/run-due", headers={"X-Admin-Key": os.getenv("ADMIN_KEY", "")}),
+            c.get(f"/ads/{ad_id}/deliveries", headers=auth),
+            # short link + redirect + métricas
+            c.post(
+                "/links",
+                content=orjson.dumps({
+                    "destination_url": "https://example.com/landing",
+                    "ad_id": ad_id,
+                    "utm_source": "tlxauto",
+                    "utm_medium": "whatsapp",
+                    "utm_campaign": "teste",
+                }),
+                headers=auth,
+            ),
         )
+        assert r_list.status_code == 200 and len(r_list.json()) >= 1
+        assert r_forbidden.status_code == 403
+        assert r_due.status_code == 200
+        assert r_deliv.status_code == 200 and isinstance(r_deliv.json(), list)
         assert r.status_code == 200, r.text
         slug = r.json()["slug"]
 
-        r = c.get(f"/r/{slug}", follow_redirects=False)
+        r = await c.get(f"/r/{slug}")
         assert r.status_code in (301, 302, 307, 308)
         assert "location" in {k.lower() for k in r.headers.keys()}
 
-        r = c.post("/events/conversion", params={"slug": slug})
+        r = await c.post("/events/conversion", params={"slug": slug})
         assert r.status_code == 200 and r.json().get("ok") is True
 
-        r = c.get("/dashboard", headers={"Authorization": f"Bearer {tok}"})
+        # eventos de métrica são gravados em lote (thread de fundo): força o flush antes de ler
+        flush_metric_events()
+
+        r = await c.get("/dashboard", headers=auth)
         assert r.status_code == 200
         d = r.json()
         assert int(d.get("clicks") or 0) >= 1
         assert int(d.get("conversions") or 0) >= 1
 
+        # auditoria também é gravada em lote: drena a fila antes de conferir as ações do fluxo
+        flush_audit()
+        with get_db() as db:
+            actions = {
+                row["action"]
+                for row in db.execute(
+                    "SELECT action FROM audit_logs WHERE tenant_id = ?", (int(body["tenant_id"]),)
+                ).fetchall()
+            }
+        assert {"ads.create", "templates.create", "ads.update"} <= actions, actions
+
+        check_audit_write_retry(int(body["tenant_id"]))
+
     print("smoke_ok")
 
 
+def main() -> None:
+    build_app()
+    check_template_regex_backends()
+    check_token_encoders()
+    asyncio.run(main_async())
+
+
 if __name__ == "__main__":
     main()
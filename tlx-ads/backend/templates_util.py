@@ -1,12 +1,66 @@
 import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 from typing import Dict
 
-VAR_PATTERN = re.compile(r"\{\{([a-zA-Z0-9_]+)\}\}")
+_VAR_RE = r"\{\{([a-zA-Z0-9_]+)\}\}"
+
+try:
+    # google-re2 (DFA, sem backtracking) quando instalado; mesma API de split do stdlib
+    import re2
+
+    VAR_PATTERN = re2.compile(_VAR_RE)
+except ImportError:  # pragma: no cover
+    # nomes de variável são só ASCII: re.ASCII evita as tabelas Unicode do engine
+    VAR_PATTERN = re.compile(_VAR_RE, re.ASCII)
+
+# Templates salvos: partes já separadas, por (template_id, updated_at), em LRU. Templates não
+# são editados in-place (só criados/apagados, ids não se repetem), então a chave não fica velha.
+_STORED_MAX = 2048
+_stored_parts: "OrderedDict[tuple[int, str], tuple[str, ...]]" = OrderedDict()
+_stored_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1024)
+def _split(text: str) -> tuple[str, ...]:
+    # Índices pares = texto literal, ímpares = nome da variável.
+    return tuple(VAR_PATTERN.split(text))
+
+
+def _render_parts(parts: tuple[str, ...], variables: Dict[str, str]) -> str:
+    out = list(parts)
+    for i in range(1, len(out), 2):
+        out[i] = str(variables.get(out[i], ""))
+    return "".join(out)
 
 
 def render_template(text: str, variables: Dict[str, str]) -> str:
-    def repl(m: re.Match[str]) -> str:
-        key = m.group(1)
-        return str(variables.get(key, ""))
+    # Corpo sem placeholder (caso comum): devolve o texto sem passar pelo regex nem pelo cache.
+    if "{{" not in text:
+        return text
+    return _render_parts(_split(text), variables)
+
+
+def _stored(tpl_id: int, updated_at: str, text: str) -> tuple[str, ...]:
+    key = (int(tpl_id), str(updated_at))
+    with _stored_lock:
+        parts = _stored_parts.get(key)
+        if parts is not None:
+            _stored_parts.move_to_end(key)
+            return parts
+    parts = tuple(VAR_PATTERN.split(text))
+    with _stored_lock:
+        _stored_parts[key] = parts
+        if len(_stored_parts) > _STORED_MAX:
+            _stored_parts.popitem(last=False)
+    return parts
+
+
+def warm_stored_template(tpl_id: int, updated_at: str, text: str) -> None:
+    # Chamado ao salvar o template: o regex roda uma vez aqui, não no primeiro render.
+    _stored(tpl_id, updated_at, text)
+
 
-    return VAR_PATTERN.sub(repl, text)
+def render_stored_template(tpl_id: int, updated_at: str, text: str, variables: Dict[str, str]) -> str:
+    return _render_parts(_stored(tpl_id, updated_at, text), variables)
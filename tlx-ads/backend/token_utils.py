@@ -1,4 +1,11 @@
-import secrets
+import base64
+import os
+
+try:
+    # base64 em C com SIMD quando disponível; mesmo formato do stdlib
+    from pybase64 import urlsafe_b64encode
+except ImportError:  # pragma: no cover
+    urlsafe_b64encode = base64.urlsafe_b64encode
 
 
 def secure_token(length_bytes: int = 32) -> str:
@@ -7,4 +14,14 @@ def secure_token(length_bytes: int = 32) -> str:
     ~43 chars quando length_bytes=32.
     """
 
-    return secrets.token_urlsafe(length_bytes)
+    return urlsafe_b64encode(os.urandom(length_bytes)).rstrip(b"=").decode("ascii")
+
+
+def secure_tokens(count: int, length_bytes: int = 32) -> list[str]:
+    """Gera `count` tokens como secure_token, com uma única leitura de os.urandom."""
+
+    raw = os.urandom(count * length_bytes)
+    return [
+        urlsafe_b64encode(raw[i : i + length_bytes]).rstrip(b"=").decode("ascii")
+        for i in range(0, count * length_bytes, length_bytes)
+    ]
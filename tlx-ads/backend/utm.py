@@ -1,4 +1,17 @@
-from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+from functools import lru_cache
+from urllib.parse import quote_plus
+
+
+@lru_cache(maxsize=4096)
+def _utm_suffix(source: str, medium: str, campaign: str, content: str | None, term: str | None) -> str:
+    # Mesma campanha gera muitos links com destinos diferentes: a query UTM é a mesma.
+    # Montada direto como string (mesmo formato do urlencode: quote_plus em cada valor).
+    s = f"utm_source={quote_plus(source)}&utm_medium={quote_plus(medium)}&utm_campaign={quote_plus(campaign)}"
+    if content:
+        s += f"&utm_content={quote_plus(content)}"
+    if term:
+        s += f"&utm_term={quote_plus(term)}"
+    return s
 
 
 def add_utm(
@@ -9,14 +22,26 @@ def add_utm(
     content: str | None = None,
     term: str | None = None,
 ) -> str:
-    parts = urlparse(url)
-    qs = dict(parse_qsl(parts.query, keep_blank_values=True))
-    qs["utm_source"] = source
-    qs["utm_medium"] = medium
-    qs["utm_campaign"] = campaign
+    suffix = _utm_suffix(source, medium, campaign, content or None, term or None)
+
+    # Caso comum (URL de landing sem query nem fragmento): só concatena.
+    if "?" not in url and "#" not in url:
+        return url + "?" + suffix
+
+    # Varredura única (find de '#' e '?') em vez de urlparse/parse_qsl/urlunparse:
+    # o resto da URL é preservado como veio, só os utm_* informados são trocados.
+    keys = {"utm_source", "utm_medium", "utm_campaign"}
     if content:
-        qs["utm_content"] = content
+        keys.add("utm_content")
     if term:
-        qs["utm_term"] = term
-    new_query = urlencode(qs, doseq=True)
-    return urlunparse((parts.scheme, parts.netloc, parts.path, parts.params, new_query, parts.fragment))
+        keys.add("utm_term")
+    frag_i = url.find("#")
+    base, frag = (url[:frag_i], url[frag_i:]) if frag_i >= 0 else (url, "")
+    q_i = base.find("?")
+    if q_i >= 0:
+        kept = [p for p in base[q_i + 1 :].split("&") if p and p.partition("=")[0] not in keys]
+        base = base[:q_i]
+    else:
+        kept = []
+    kept.append(suffix)
+    return base + "?" + "&".join(kept) + frag